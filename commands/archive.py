@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from commands.common import form_logger, get_settings
+from commands.storage import form_database_handler
+from persistence.archive import add_months, month_start
+
+# Meses de records que ficam na base de dados e partições criadas à frente do mês atual
+ARCHIVE_RETENTION_MONTHS = 12
+ARCHIVE_PARTITIONS_AHEAD = 2
+
+def archive_command(args):
+    # logger
+    main_logger = form_logger(args.debug, args.file_log, "archive")
+
+    # definições
+    app_settings = get_settings(f"{args.settings}.json")
+    archive_settings = app_settings["app"].get("archive")
+    if archive_settings is None:
+        main_logger.error("No archive settings. Set app.archive.dir first")
+        return
+
+    # base de dados
+    db_handler = form_database_handler(app_settings, main_logger)
+    now = datetime.now()
+    try:
+        if not args.dry_run:
+            db_handler.partition_records(add_months(now, archive_settings.get("partitions-ahead", ARCHIVE_PARTITIONS_AHEAD)))
+
+        cutoff = add_months(month_start(now), -archive_settings.get("retention-months", ARCHIVE_RETENTION_MONTHS))
+        months = db_handler.get_archivable_months(cutoff)
+        main_logger.info(f"Months to archive before {cutoff:%Y-%m}: {[f'{month:%Y-%m}' for month in months]}")
+        if args.dry_run:
+            return
+
+        # Do mais antigo para o mais recente. O ficheiro fica completo antes de o mês sair da tabela
+        for month in months:
+            columns = db_handler.get_month_columns(month)
+            archived_count = db_handler.archive.write_month(month, columns)
+            if not db_handler.drop_month(month, archived_count):
+                return
+        main_logger.info("Finished archiving records")
+    finally:
+        db_handler.close()
@@ -0,0 +1,25 @@
+import json
+
+from commands.common import form_logger, get_settings
+from objects.bench import compare_results, run_bench
+
+def bench_command(args):
+    # logger
+    main_logger = form_logger(args.debug, False, "bench")
+
+    # definições. Só a parte do OCR interessa, não há câmara nem base de dados
+    app_settings = get_settings(f"{args.settings}.json")
+    engine_names = args.engines or [app_settings["ocr"].get("engine", "tesserocr")]
+
+    results = run_bench(app_settings["ocr"], args.frames, engine_names, main_logger, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        main_logger.info(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            previous = json.load(file)
+        if not compare_results(previous, results, main_logger):
+            raise SystemExit(1)
@@ -0,0 +1,42 @@
+import json
+import logging
+from datetime import datetime
+
+def form_logger(is_debug: bool, is_file_log: bool, mod_name: str) -> logging.Logger:
+
+    logging_level = logging.DEBUG if is_debug else logging.INFO
+    
+    # Create logger
+    logger = logging.getLogger(f"Boiler OCR - {mod_name}")
+    logger.setLevel(logging_level)
+    
+    # Remove existing handlers to avoid duplicates
+    logger.handlers.clear()
+    
+    # Create formatter
+    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
+    
+    # Create appropriate handler
+    if is_file_log:
+        fname = f"{datetime.now().date().strftime('%Y-%m-%d')}_boiler_ocr_{mod_name}.log"
+        handler = logging.FileHandler(fname)
+    else:
+        handler = logging.StreamHandler()
+    
+    handler.setLevel(logging_level)
+    handler.setFormatter(formatter)
+    
+    # Add handler to logger
+    logger.addHandler(handler)
+    
+    return logger
+
+def get_settings(file_name : str) -> dict:
+    settings = None
+    with open(file_name, 'r') as file:
+        settings = json.load(file)
+    return settings
+
+def get_boiler_ids(app_settings : dict) -> list[int]:
+    cameras = app_settings.get("cameras", [app_settings.get("camera", {})])
+    return sorted({camera.get("boiler", 1) for camera in cameras})
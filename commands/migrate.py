@@ -0,0 +1,26 @@
+from commands.common import form_logger, get_settings
+from commands.storage import form_database_handler
+
+def migrate_command(args):
+    # logger
+    main_logger = form_logger(args.debug, args.file_log, "migrate")
+
+    # definições
+    app_settings = get_settings(f"{args.settings}.json")
+
+    # base de dados. O esquema só muda aqui, nunca no arranque dos outros subcomandos
+    db_handler = form_database_handler(app_settings, main_logger)
+    try:
+        changes = db_handler.get_schema_changes()
+        if len(changes) == 0:
+            main_logger.info("Database schema is up to date")
+            return
+        if args.dry_run:
+            for statement in changes:
+                main_logger.info(f"Pending: {statement}")
+            return
+
+        db_handler.migrate_schema()
+        main_logger.info(f"Finished migrating the database schema ({len(changes)} tables)")
+    finally:
+        db_handler.close()
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from commands.common import form_logger, get_settings
+from commands.storage import form_database_handler
+
+def reference_command(args):
+    # logger
+    main_logger = form_logger(args.debug, False, "reference")
+    
+    # definições
+    app_settings = get_settings(f"{args.settings}.json")
+
+    # base de dados
+    db_handler = form_database_handler(app_settings, main_logger)
+
+    # Os dados que existem sem informação de consumo adicional
+    report_ids_to_proc = db_handler.get_partial_reports()
+
+    if report_ids_to_proc is None or len(report_ids_to_proc) == 0:
+        main_logger.info("No reports found that require reference data. Exiting.")
+        return
+
+    for report_id in report_ids_to_proc:
+        try:
+            print(f"Para o relatório ID {report_id[0]} que vai de {report_id[1]} a {report_id[2]}")
+            reference_consumption = input("Sacos de pellets consumidos: ")
+            reference_temperature = int(input("Temperatura de referência para o consumo: "))
+            reference_sensor = float(input("Temperatura de referência para o sensor: "))
+
+            data = {
+                "id": int(datetime.now().timestamp()),
+                "report_id": report_id[0],
+                "quantity": reference_consumption,
+                "max_boiler_temperature": reference_temperature,
+                "max_room_temperature": reference_sensor
+                }
+            
+            db_handler.insert_consumption_record(data)
+
+            print("Para proseguir carrega no ENTER. Para sair, carrega CTRL+C")
+            input()
+
+        except ValueError:
+            main_logger.warning("Valor inválido")
+
+        except Exception as e:
+            main_logger.error(f"Falhou a persistir: {e}")
+            break
+        except KeyboardInterrupt:
+            main_logger.info("Fim do programa")
+            break
+    main_logger.info("Todos os relatórios processados")
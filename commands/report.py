@@ -0,0 +1,82 @@
+import logging
+from datetime import datetime
+
+from commands.common import form_logger, get_boiler_ids, get_settings
+from commands.storage import form_database_handler
+from objects.analytics import BulkReportProcessor, ReportProcessor
+from persistence.database import MariaDBHandler
+
+REPORT_BATCH_SIZE = 50
+
+def report_command(args):
+
+    # logger
+    main_logger = form_logger(args.debug, args.file_log, "report")
+    
+    # definições
+    app_settings = get_settings(f"{args.settings}.json")
+
+    # base de dados
+    db_handler = form_database_handler(app_settings, main_logger)
+
+    # Um report por caldeira. Sem lista de câmaras só existe a caldeira 1
+    for boiler_id in get_boiler_ids(app_settings):
+        if args.rebuild:
+            rebuild_reports(args, db_handler, main_logger, boiler_id)
+        else:
+            update_reports(app_settings, db_handler, main_logger, boiler_id)
+
+def update_reports(app_settings : dict, db_handler : MariaDBHandler, main_logger : logging.Logger, boiler_id : int):
+    # Só lê o que entrou depois do último report. Um ciclo a meio continua do estado guardado
+    last_timestamp, state = db_handler.get_report_checkpoint(boiler_id)
+    records = db_handler.get_report_records_after(last_timestamp, app_settings["app"]["database"].get("stream-chunk", 1000), boiler_id)
+
+    report_records = ReportProcessor(main_logger, state)
+    records_to_persist = []
+
+    # Os reports são gravados por lotes enquanto o cursor ainda está a ler
+    for record in report_records.process_report_data(records):
+        main_logger.info(f"Persisting report record for boiler {boiler_id} with start time {record.start_time} and end time {record.end_time}")
+        records_to_persist.append(record)
+        if len(records_to_persist) >= REPORT_BATCH_SIZE:
+            if db_handler.insert_report_progress(records_to_persist, report_records.last_timestamp, report_records.state, boiler_id) is None:
+                return
+            records_to_persist = []
+
+    main_logger.info(f"Records fetched for boiler {boiler_id}: {report_records.processed}")
+    if report_records.last_timestamp is None:
+        main_logger.info("No new records since the last report")
+        return
+
+    if db_handler.insert_report_progress(records_to_persist, report_records.last_timestamp, report_records.state, boiler_id) is None:
+        return
+
+    main_logger.info("Finished processing report data")
+
+def rebuild_reports(args, db_handler : MariaDBHandler, main_logger : logging.Logger, boiler_id : int = 1):
+    # Recalcula todos os reports do período de uma vez. Um ciclo a meio no --from fica com o report que já tem
+    start_time = datetime.fromisoformat(args.from_date) if args.from_date else datetime(2026, 2, 3)
+    end_time = datetime.fromisoformat(args.to_date) if args.to_date else datetime.now()
+    # Depois do checkpoint é o report incremental que manda. Um ciclo fechado ou a meio depois dele seria inserido duas vezes
+    last_timestamp, _ = db_handler.get_report_checkpoint(boiler_id)
+    if last_timestamp is not None and end_time > datetime.fromtimestamp(last_timestamp + 1):
+        end_time = datetime.fromtimestamp(last_timestamp + 1)
+        main_logger.info(f"Rebuild for boiler {boiler_id} stops at the report checkpoint, {end_time}")
+
+    arrays = db_handler.get_record_arrays(int(start_time.timestamp()), int(end_time.timestamp()), boiler_id=boiler_id)
+    main_logger.info(f"Records fetched for boiler {boiler_id}: {len(arrays['timestamps'])}")
+    if len(arrays["is_burning"]) > 0 and arrays["is_burning"][0] and db_handler.was_burning_before(int(start_time.timestamp()), boiler_id):
+        # O ciclo já começou antes do --from e o report dele está inteiro. Recomeça na primeira leitura parada
+        if arrays["is_burning"].all():
+            main_logger.warning(f"Boiler was burning for the whole period from {start_time}. Nothing to rebuild")
+            return
+        first_stop = int(arrays["is_burning"].argmin())
+        arrays = {name: column[first_stop:] for name, column in arrays.items()}
+        stop_time = datetime.fromtimestamp(int(arrays["timestamps"][0]))
+        main_logger.warning(f"Boiler was already burning at {start_time}. Keeping that cycle's report and rebuilding from {stop_time}")
+        start_time = stop_time
+
+    reports = BulkReportProcessor(main_logger).process_report_arrays(arrays["timestamps"], arrays["temperatures"],
+                                                                     arrays["mode_codes"], arrays["is_burning"])
+    db_handler.replace_reports(reports, start_time, end_time, boiler_id)
+    main_logger.info("Finished rebuilding report data")
@@ -0,0 +1,36 @@
+import logging
+from datetime import datetime
+
+from commands.common import form_logger, get_boiler_ids, get_settings
+from commands.storage import form_database_handler
+from objects.rollups import RollupProcessor
+from persistence.database import MariaDBHandler
+
+def rollup_command(args):
+    # logger
+    main_logger = form_logger(args.debug, args.file_log, "rollup")
+
+    # definições
+    app_settings = get_settings(f"{args.settings}.json")
+
+    # base de dados
+    db_handler = form_database_handler(app_settings, main_logger)
+
+    for boiler_id in get_boiler_ids(app_settings):
+        update_rollups(db_handler, main_logger, boiler_id)
+    db_handler.close()
+
+def update_rollups(db_handler : MariaDBHandler, main_logger : logging.Logger, boiler_id : int):
+    # Só os records depois da marca de água. A última leitura do checkpoint dá o tempo até à primeira nova
+    last_timestamp, state = db_handler.get_report_checkpoint(boiler_id, "rollup")
+    start_timestamp = 0 if last_timestamp is None else last_timestamp + 1
+    arrays = db_handler.get_record_arrays(start_timestamp, int(datetime.now().timestamp()) + 1, boiler_id=boiler_id)
+    main_logger.info(f"Records fetched for boiler {boiler_id}: {len(arrays['timestamps'])}")
+    if len(arrays["timestamps"]) == 0:
+        main_logger.info("No new records since the last rollup")
+        return
+
+    rollups = RollupProcessor(main_logger, state)
+    hourly_rows, daily_rows = rollups.process_record_arrays(arrays["timestamps"], arrays["temperatures"],
+                                                            arrays["mode_codes"], arrays["is_burning"])
+    db_handler.insert_rollup_progress(hourly_rows, daily_rows, rollups.last_timestamp, rollups.state, boiler_id)
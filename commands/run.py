@@ -0,0 +1,213 @@
+import logging
+import signal
+import time
+
+import cv2
+
+from commands.common import form_logger, get_settings
+from commands.storage import form_database_handler
+from objects.boiler import BoilerRecorder
+from objects.metrics import form_metrics_exporter
+from objects.camera import FrameSource, form_camera_source
+from objects.ocr import FrameChangeGate, extract_text_burst, form_display_regions, form_ocr_engine, form_preprocessor
+from objects.pipeline import CapturePipeline
+from objects.scheduler import form_scheduler
+from objects.state import form_state_server
+from objects.supervisor import CaptureSupervisor
+from persistence.database import MariaDBHandler
+from persistence.spool import RecordSpool
+
+def handle_sigterm(signum=None, frame=None):
+    raise KeyboardInterrupt
+
+def close_debug_windows():
+    # Builds headless do OpenCV (CI, replay) não têm janelas para fechar
+    try:
+        cv2.destroyAllWindows()
+    except cv2.error:
+        pass
+
+def form_record_sink(args, app_settings : dict, main_logger : logging.Logger):
+    if args.dry_run == True:
+        return None, None, None
+
+    if "spool" not in app_settings["app"]:
+        db_handler = form_database_handler(app_settings, main_logger)
+        return db_handler, None, db_handler
+
+    # Com spool o ciclo escreve para o disco local. A thread do spool liga-se à base de dados quando ela estiver disponível
+    spool_settings = app_settings["app"]["spool"]
+    spool = RecordSpool(spool_settings["file"], main_logger,
+                        spool_settings.get("batch-size", 500),
+                        spool_settings.get("interval", 1))
+    spool.start(lambda: form_database_handler(app_settings, main_logger))
+    return None, spool, spool
+
+def form_tick(db_handler : MariaDBHandler, metrics_exporter):
+    # Trabalho periódico que corre na thread principal enquanto as câmaras trabalham
+    def tick():
+        if db_handler is not None:
+            db_handler.flush_if_due()
+        if metrics_exporter is not None:
+            metrics_exporter.tick()
+    return tick
+
+def close_record_sink(db_handler : MariaDBHandler, spool : RecordSpool):
+    # Os registos ainda em memória vão para a base de dados antes de sair. O spool fecha o seu handler
+    if spool is not None:
+        spool.stop()
+    if db_handler is not None:
+        db_handler.close()
+
+def form_ocr_stage(app_settings : dict, main_logger : logging.Logger):
+    ocr_engine = form_ocr_engine(app_settings["ocr"], main_logger)
+    main_logger.info(f"OCR engine: {ocr_engine.name}")
+
+    # Diferença média (0-255) abaixo da qual o frame é considerado igual ao anterior
+    change_gate = None
+    if "change-threshold" in app_settings["ocr"]:
+        change_gate = FrameChangeGate(app_settings["ocr"]["change-threshold"])
+
+    regions = form_display_regions(app_settings["ocr"].get("roi"), app_settings["ocr"])
+    # Buffers de conversão reaproveitados entre frames. Limiar fixo, Otsu ou adaptativo
+    preprocessor = form_preprocessor(app_settings["ocr"])
+
+    return ocr_engine, change_gate, regions, preprocessor
+
+def run_pipeline(args, app_settings : dict, main_logger : logging.Logger, metrics_exporter=None):
+    ocr_engine, change_gate, regions, preprocessor = form_ocr_stage(app_settings, main_logger)
+    source = form_camera_source(app_settings["camera"])
+    db_handler, spool, record_sink = form_record_sink(args, app_settings, main_logger)
+
+    recorder = BoilerRecorder(main_logger, args.dry_run, record_sink, app_settings["camera"].get("boiler", 1))
+    pipeline = CapturePipeline(source, app_settings["camera"], ocr_engine, recorder, main_logger,
+                               form_scheduler(app_settings["app"], app_settings["app"].get("wait", 0)), regions, change_gate,
+                               app_settings["app"].get("queue-size", 4), preprocessor=preprocessor)
+
+    try:
+        main_logger.info("Video feed started. Analyzing frames.")
+        pipeline.start()
+        pipeline.wait(form_tick(db_handler, metrics_exporter))
+    except KeyboardInterrupt:
+        main_logger.info("Finished capture")
+    finally:
+        pipeline.stop()
+        ocr_engine.close()
+        close_record_sink(db_handler, spool)
+
+def supervise_cameras(args, app_settings : dict, main_logger : logging.Logger, metrics_exporter=None):
+    db_handler, spool, record_sink = form_record_sink(args, app_settings, main_logger)
+    supervisor = CaptureSupervisor(app_settings, main_logger, args.dry_run, record_sink)
+
+    try:
+        supervisor.start()
+        supervisor.wait(form_tick(db_handler, metrics_exporter))
+        main_logger.critical("Every camera gave up")
+    except KeyboardInterrupt:
+        main_logger.info("Finished capture")
+    finally:
+        supervisor.stop()
+        close_record_sink(db_handler, spool)
+
+def run_command(args):
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    # logger
+    main_logger = form_logger(args.debug, args.file_log, "main")    
+
+    # definições
+    app_settings = get_settings(f"{args.settings}.json")
+
+    # Tempos por etapa e contadores em /metrics ou num ficheiro para o node_exporter
+    metrics_exporter = form_metrics_exporter(app_settings["app"], main_logger)
+    # Última leitura de cada caldeira em /state, direto da memória
+    state_server = form_state_server(app_settings["app"], main_logger)
+    try:
+        # Várias câmaras num só processo
+        if "cameras" in app_settings:
+            supervise_cameras(args, app_settings, main_logger, metrics_exporter)
+            return
+
+        # Etapas em threads com período fixo em vez de dormir depois de cada ciclo
+        if app_settings["app"].get("pipeline", False):
+            run_pipeline(args, app_settings, main_logger, metrics_exporter)
+            return
+
+        capture_frames(args, app_settings, main_logger, metrics_exporter)
+    finally:
+        if metrics_exporter is not None:
+            metrics_exporter.stop()
+        if state_server is not None:
+            state_server.stop()
+
+def capture_frames(args, app_settings : dict, main_logger : logging.Logger, metrics_exporter=None):
+    ocr_engine, change_gate, regions, preprocessor = form_ocr_stage(app_settings, main_logger)
+    
+    # Base de dados e video
+    # Câmara, câmara com gravação ou uma sessão gravada
+    source = form_camera_source(app_settings["camera"])
+    wait_time = 0 if "wait" not in app_settings["app"] else app_settings["app"]["wait"]
+    # O mesmo FrameSource do pipeline e do supervisor. Persistente ou a ligar por frame, com burst para votar
+    frame_source = FrameSource(source, app_settings["camera"], main_logger)
+    # Abranda com a caldeira parada ou estável e acelera quando muda
+    scheduler = form_scheduler(app_settings["app"], wait_time)
+
+    main_logger.info("Video feed started. Analyzing frames.")
+
+    db_handler, spool, record_sink = form_record_sink(args, app_settings, main_logger)
+    tick = form_tick(db_handler, metrics_exporter)
+    
+    main_logger.debug(f"Trying to connect to {source}")
+    frame_source.start()
+
+    try:
+        
+        recorder = BoilerRecorder(main_logger, args.dry_run, record_sink, app_settings["camera"].get("boiler", 1))
+
+        while True:
+            tick()
+
+            frames = frame_source.read_burst()
+            if len(frames) == 0:
+                # Por frame o FrameSource já tentou ligar várias vezes. Persistente o grabber continua a tentar
+                if frame_source.finished:
+                    main_logger.info("Replay finished")
+                    return
+                if not frame_source.is_persistent:
+                    main_logger.critical("Couldn't read frame. Giving up.")
+                    return
+                main_logger.warning("No recent frame available. Waiting for the video feed.")
+                time.sleep(max(wait_time, 1))
+                continue
+            captured_at = frame_source.capture_time()
+            
+            # Tesseract analisa a imagem e transforma numa string
+            detected_text = extract_text_burst(frames, args.debug, ocr_engine, change_gate, regions, preprocessor)
+            
+            main_logger.debug(f"Detected Text: {detected_text}")
+            if ocr_engine.confidences:
+                main_logger.debug(f"Character confidence: {[round(c, 2) for c in ocr_engine.confidences]}")
+            if change_gate is not None:
+                main_logger.debug(f"OCR cache hits {change_gate.hits} misses {change_gate.misses}")
+            try:
+                # Leitura repetida ou caldeira parada também espera o intervalo do agendador
+                recorder.handle(detected_text, frame_age=time.monotonic() - captured_at)
+                scheduler.observe(recorder.last_result, recorder.stop_recording)
+
+            except Exception as e:
+                main_logger.warning(f"Failed while forming the log. Retrying in the next cycle {e}. OCR is {detected_text}")
+            
+            main_logger.debug(f"Next sample in {scheduler.interval:.1f}s")
+            time.sleep(scheduler.interval)
+
+    except KeyboardInterrupt:
+        if change_gate is not None:
+            main_logger.info(f"OCR cache hits {change_gate.hits} misses {change_gate.misses} ({change_gate.hit_ratio:.0%})")
+        main_logger.info("Finished capture")
+        return
+    finally:
+        # Para o grabber e fecha a fonte (gravação ou reprodução)
+        frame_source.stop()
+        ocr_engine.close()
+        close_debug_windows()
+        close_record_sink(db_handler, spool)
@@ -0,0 +1,21 @@
+import json
+
+from commands.common import form_logger
+from objects.startup import STARTUP_COMMANDS, compare_startup, package_dir, run_startup_bench
+
+def startup_command(args):
+    # logger
+    main_logger = form_logger(args.debug, False, "startup")
+
+    results = run_startup_bench(package_dir(), args.commands or list(STARTUP_COMMANDS), main_logger, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        main_logger.info(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            previous = json.load(file)
+        if not compare_startup(previous, results, main_logger):
+            raise SystemExit(1)
@@ -0,0 +1,28 @@
+import logging
+
+from persistence.archive import RecordArchive
+from persistence.database import POOL_RECYCLE, MariaDBHandler
+
+def form_database_connection(user : str, pwd : str, host : str, db : str):
+    database_url = f"mariadb+mariadbconnector://{user}:{pwd}@{host}/{db}"
+    return database_url
+
+def form_database_handler(app_settings : dict, main_logger : logging.Logger) -> MariaDBHandler:
+    # A mesma configuração do pool para o run, o report e o reference
+    database_settings = app_settings["app"]["database"]
+    database_url = form_database_connection(database_settings["user"],
+                                            database_settings["password"],
+                                            database_settings["host"],
+                                            database_settings["database"]
+                                            )
+    # Com arquivo configurado os meses antigos são lidos dos ficheiros sem o report dar por isso
+    archive_settings = app_settings["app"].get("archive")
+    archive = None if archive_settings is None else RecordArchive(archive_settings["dir"], main_logger)
+    return MariaDBHandler(database_url, main_logger,
+                          database_settings.get("batch-size", 1),
+                          database_settings.get("flush-interval", 0),
+                          database_settings.get("pool-size", 2),
+                          database_settings.get("pool-recycle", POOL_RECYCLE),
+                          database_settings.get("retries", 3),
+                          database_settings.get("retry-delay", 1),
+                          archive)
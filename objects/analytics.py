@@ -1,25 +1,41 @@
+from __future__ import annotations
+
 from datetime import datetime
 import logging
 import math
-from statistics import mean
+from collections.abc import Iterable, Iterator
 import time
 
+
 from datetime import time, datetime, timedelta
 
+REPORT_MODES = ("1", "2", "3", "4", "5", "A")
+# Índice de cada modo nos arrays do processamento em bloco. -1 para modos desconhecidos
+MODE_CODES = {mode: index for index, mode in enumerate(REPORT_MODES)}
+# Colunas com os segundos de cada modo nas tabelas de rollup
+MODE_COLUMNS = tuple(f"Mode{mode}Seconds" for mode in REPORT_MODES)
+
 class ReportData:
+    # Acumuladores de tamanho fixo. Nada cresce com a duração do ciclo
+    __slots__ = ("log", "_start_time", "_end_time", "_start_timestamp", "_last_accounted",
+                 "_temperature_sum", "_temperature_squares", "_temperature_count",
+                 "_temperature_min", "_temperature_max", "_mode_seconds",
+                 "max_room_temperature", "has_standby")
+
     def __init__(self, logger : logging.Logger):
         self.log = logger
         self._start_time = None
         self._end_time = None
-        self._avg_temperature = []
+        self._start_timestamp = None
+        # Até onde o tempo do ciclo já foi atribuído a um modo
+        self._last_accounted = None
+        self._temperature_sum = 0
+        self._temperature_squares = 0
+        self._temperature_count = 0
+        self._temperature_min = None
+        self._temperature_max = None
+        self._mode_seconds = dict.fromkeys(REPORT_MODES, 0)
         self.max_room_temperature = 22
-        self._mode_1 = timedelta(0)
-        self._mode_2 = timedelta(0)
-        self._mode_3 = timedelta(0)
-        self._mode_4 = timedelta(0)
-        self._mode_5 = timedelta(0)
-        self._mode_A = timedelta(0)
-        self._total_duration = timedelta(0)
         self.has_standby = False
 
     def parse_timedelta_to_time(self, td: timedelta) -> time:
@@ -37,6 +53,8 @@ class ReportData:
 
         if self._start_time is None:
             self._start_time = datetime.fromtimestamp(unix_timestamp)
+            self._start_timestamp = unix_timestamp
+            self._last_accounted = unix_timestamp
 
     @property
     def end_time(self):
@@ -45,34 +63,23 @@ class ReportData:
     @property
     def operation_time(self):
 
-        return {"mode1": self.parse_timedelta_to_time(self._mode_1),
-                "mode2": self.parse_timedelta_to_time(self._mode_2),
-                "mode3": self.parse_timedelta_to_time(self._mode_3),
-                "mode4": self.parse_timedelta_to_time(self._mode_4),
-                "mode5": self.parse_timedelta_to_time(self._mode_5),
-                "modeA": self.parse_timedelta_to_time(self._mode_A)
+        return {"mode1": self.parse_timedelta_to_time(timedelta(seconds=self._mode_seconds["1"])),
+                "mode2": self.parse_timedelta_to_time(timedelta(seconds=self._mode_seconds["2"])),
+                "mode3": self.parse_timedelta_to_time(timedelta(seconds=self._mode_seconds["3"])),
+                "mode4": self.parse_timedelta_to_time(timedelta(seconds=self._mode_seconds["4"])),
+                "mode5": self.parse_timedelta_to_time(timedelta(seconds=self._mode_seconds["5"])),
+                "modeA": self.parse_timedelta_to_time(timedelta(seconds=self._mode_seconds["A"]))
                 }
     @operation_time.setter
     def operation_time(self, data : tuple[str, int]):
         mode = str(data[0])
         unix_timestamp = int(data[1])
 
-        # Lixado - Pode já ter ocorrido um incremento nos modos. Assim faz se a diferença de tempo
-        # entre eles todos. A ordem garante precisão.  
-        modes_diff = (self._mode_1 + self._mode_2 + self._mode_3 + self._mode_4 + self._mode_5 + self._mode_A)
-
-        if mode == "1":
-            self._mode_1 += timedelta(seconds=unix_timestamp - self.start_time.timestamp() - modes_diff.total_seconds())
-        elif mode == "2":
-            self._mode_2 += timedelta(seconds=unix_timestamp - self.start_time.timestamp() - modes_diff.total_seconds())
-        elif mode == "3":
-            self._mode_3 += timedelta(seconds=unix_timestamp - self.start_time.timestamp() - modes_diff.total_seconds())
-        elif mode == "4":
-            self._mode_4 += timedelta(seconds=unix_timestamp - self.start_time.timestamp() - modes_diff.total_seconds())
-        elif mode == "5":
-            self._mode_5 += timedelta(seconds=unix_timestamp - self.start_time.timestamp() - modes_diff.total_seconds())
-        elif mode == "A":
-            self._mode_A += timedelta(seconds=unix_timestamp - self.start_time.timestamp() - modes_diff.total_seconds())
+        # O tempo desde a última leitura contabilizada vai para o modo actual.
+        # Um modo desconhecido não conta e o intervalo passa para a leitura seguinte
+        if mode in self._mode_seconds:
+            self._mode_seconds[mode] += unix_timestamp - self._last_accounted
+            self._last_accounted = unix_timestamp
 
     @end_time.setter
     def end_time(self, unix_timestamp: int):
@@ -82,38 +89,176 @@ class ReportData:
 
     @property
     def avg_temperature(self):
-        return round(mean(self._avg_temperature),1)
+        return round(self._temperature_sum / self._temperature_count, 1)
     
     @avg_temperature.setter
     def avg_temperature(self, temperature: int):
-        self._avg_temperature.append(temperature)
+        self._temperature_sum += temperature
+        self._temperature_squares += temperature * temperature
+        self._temperature_count += 1
+        if self._temperature_min is None or temperature < self._temperature_min:
+            self._temperature_min = temperature
+        if self._temperature_max is None or temperature > self._temperature_max:
+            self._temperature_max = temperature
+
+    @property
+    def min_temperature(self):
+        return self._temperature_min
+
+    @property
+    def max_temperature(self):
+        return self._temperature_max
+
+    @property
+    def temperature_variance(self):
+        # Variância da população, exacta porque as temperaturas são inteiras
+        count = self._temperature_count
+        return (count * self._temperature_squares - self._temperature_sum ** 2) / (count * count)
 
     @property
     def total_duration(self):
         time_diff = self._end_time - self._start_time
         return self.parse_timedelta_to_time(time_diff)
 
+    def to_state(self) -> dict:
+        # Estado de um ciclo ainda aberto, para o próximo report continuar daqui
+        return {"start_time": self._start_timestamp,
+                "last_accounted": self._last_accounted,
+                "temperature_sum": self._temperature_sum,
+                "temperature_squares": self._temperature_squares,
+                "temperature_count": self._temperature_count,
+                "temperature_min": self._temperature_min,
+                "temperature_max": self._temperature_max,
+                "modes": dict(self._mode_seconds),
+                "has_standby": self.has_standby
+                }
+
+    @classmethod
+    def from_state(cls, state : dict, logger : logging.Logger):
+        report = cls(logger)
+        report.start_time = state["start_time"]
+        report._temperature_sum = state["temperature_sum"]
+        report._temperature_count = state["temperature_count"]
+        report._temperature_squares = state.get("temperature_squares", 0)
+        report._temperature_min = state.get("temperature_min")
+        report._temperature_max = state.get("temperature_max")
+        for mode in REPORT_MODES:
+            report._mode_seconds[mode] = int(state["modes"][mode])
+        # Checkpoints antigos não guardavam a última leitura. É o início mais o tempo já atribuído
+        report._last_accounted = state.get("last_accounted", report._start_timestamp + sum(report._mode_seconds.values()))
+        report.has_standby = state["has_standby"]
+        return report
+
 class ReportProcessor:
-    def __init__(self, logger : logging.Logger):
+    def __init__(self, logger : logging.Logger, state : dict = None):
         self.log = logger
-    
-    def process_report_data(self, raw_data : list[tuple]) -> list[ReportData]:
-        report_data_list = []
-        current_report = None
+        # Ciclo que ficou aberto no último report
+        self.current_report = None if state is None else ReportData.from_state(state, logger)
+        self.last_timestamp = None
+        self.processed = 0
 
+    @property
+    def state(self):
+        if self.current_report is None:
+            return None
+        return self.current_report.to_state()
+    
+    def process_report_data(self, raw_data : Iterable[tuple]) -> Iterator[ReportData]:
+        # Devolve cada ciclo assim que fecha. Quem chama pode persistir enquanto lê o resto
         for row in raw_data:
-            if row[4] == True and current_report is None:
-                current_report = ReportData(self.log)
-                current_report.start_time = row[0]
+            self.last_timestamp = row[0]
+            self.processed += 1
+
+            if row[4] == True and self.current_report is None:
+                self.current_report = ReportData(self.log)
+                self.current_report.start_time = row[0]
             
-            if row[4] == True and current_report is not None:
-                current_report.avg_temperature = row[1]
-                current_report.operation_time = (row[3], row[0])
+            if row[4] == True and self.current_report is not None:
+                self.current_report.avg_temperature = row[1]
+                self.current_report.operation_time = (row[3], row[0])
             
-            elif row[4] == False and current_report is not None:
-                current_report.end_time = row[0]
-                report_data_list.append(current_report)
-                current_report = None
-        
-        return report_data_list
+            elif row[4] == False and self.current_report is not None:
+                self.current_report.end_time = row[0]
+                finished_report = self.current_report
+                self.current_report = None
+                yield finished_report
+
+class BulkReportProcessor:
+    """
+    Reconstrói os reports de um período inteiro com arrays NumPy.
+    Dá o mesmo resultado que o ReportProcessor linha a linha sobre as mesmas leituras.
+    """
+    def __init__(self, logger : logging.Logger):
+        self.log = logger
+
+    def process_report_arrays(self, timestamps : np.ndarray, temperatures : np.ndarray,
+                              mode_codes : np.ndarray, is_burning : np.ndarray) -> list[ReportData]:
+        # O NumPy só é carregado aqui. O reference usa este módulo através da base de dados e não precisa dele
+        import numpy as np
+
+        rows = len(timestamps)
+        if rows == 0:
+            return []
+
+        timestamps = timestamps.astype(np.int64)
+        temperatures = temperatures.astype(np.int64)
+        is_burning = is_burning.astype(bool)
 
+        # Um ciclo começa na primeira leitura a queimar e acaba na primeira que não queima
+        changes = np.diff(is_burning.astype(np.int8), prepend=np.int8(0))
+        starts = np.flatnonzero(changes == 1)
+        ends = np.flatnonzero(changes == -1)
+        # Ciclo ainda aberto no fim do período fica de fora, tal como no processamento normal
+        starts = starts[:len(ends)]
+        cycles = len(starts)
+        if cycles == 0:
+            return []
+
+        # Somas sobre [início, fim) de cada ciclo. O reduceat com pares intercalados dá os intervalos
+        bounds = np.empty(cycles * 2, dtype=np.int64)
+        bounds[0::2] = starts
+        bounds[1::2] = ends
+        counts = ends - starts
+        sums = np.add.reduceat(temperatures, bounds)[0::2]
+        squares = np.add.reduceat(temperatures * temperatures, bounds)[0::2]
+        minimums = np.minimum.reduceat(temperatures, bounds)[0::2]
+        maximums = np.maximum.reduceat(temperatures, bounds)[0::2]
+
+        # Cada leitura com modo conhecido recebe o tempo desde a anterior com modo conhecido no ciclo,
+        # ou desde o início do ciclo se for a primeira
+        in_cycle = np.zeros(rows + 1, dtype=np.int64)
+        np.add.at(in_cycle, starts, 1)
+        np.add.at(in_cycle, ends, -1)
+        in_cycle = np.cumsum(in_cycle)[:rows] > 0
+        cycle_ids = np.cumsum(changes == 1) - 1
+
+        known = np.flatnonzero(in_cycle & (mode_codes >= 0))
+        known_cycles = cycle_ids[known]
+        known_timestamps = timestamps[known]
+        previous = np.empty_like(known_timestamps)
+        previous[1:] = known_timestamps[:-1]
+        first_in_cycle = np.ones(len(known), dtype=bool)
+        first_in_cycle[1:] = known_cycles[1:] != known_cycles[:-1]
+        previous[first_in_cycle] = timestamps[starts][known_cycles[first_in_cycle]]
+
+        durations = np.bincount(known_cycles * len(REPORT_MODES) + mode_codes[known],
+                                weights=known_timestamps - previous,
+                                minlength=cycles * len(REPORT_MODES)).reshape(cycles, len(REPORT_MODES))
+
+        # Poucos ciclos. Montar os objectos em Python não pesa
+        report_data_list = []
+        for cycle in range(cycles):
+            report = ReportData.from_state({"start_time": int(timestamps[starts[cycle]]),
+                                            "temperature_sum": int(sums[cycle]),
+                                            "temperature_squares": int(squares[cycle]),
+                                            "temperature_count": int(counts[cycle]),
+                                            "temperature_min": int(minimums[cycle]),
+                                            "temperature_max": int(maximums[cycle]),
+                                            "modes": {mode: int(durations[cycle, index]) for index, mode in enumerate(REPORT_MODES)},
+                                            "has_standby": False
+                                            }, self.log)
+            report.end_time = int(timestamps[ends[cycle]])
+            report_data_list.append(report)
+
+        self.log.info(f"Rebuilt {cycles} reports from {rows} records")
+        return report_data_list
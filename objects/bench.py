@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import resource
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from objects.boiler import form_boiler_data
+from objects.ocr import extract_text, form_display_regions, form_ocr_engine, form_preprocessor
+
+LABELS_FILE = "labels.json"
+FRAME_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+BENCH_FIELDS = ("time", "mode", "temperature", "burning")
+
+# Leituras erradas são o que o benchmark quer contar, não avisos
+_quiet_logger = logging.getLogger("boiler.bench")
+_quiet_logger.addHandler(logging.NullHandler())
+_quiet_logger.propagate = False
+
+def load_fixtures(frames_dir : str) -> list[tuple[str, np.ndarray, dict]]:
+    """
+    Frames gravados do visor e o que lá estava escrito.
+    O labels.json tem por ficheiro {"time": "12:30", "mode": "A", "temperature": 60, "burning": true}.
+    """
+    with open(os.path.join(frames_dir, LABELS_FILE), "r") as file:
+        labels = json.load(file)
+
+    fixtures = []
+    for file_name in sorted(labels):
+        if not file_name.lower().endswith(FRAME_EXTENSIONS):
+            continue
+        frame = cv2.imread(os.path.join(frames_dir, file_name), cv2.IMREAD_UNCHANGED)
+        if frame is None:
+            raise ValueError(f"Couldn't read fixture frame {file_name}")
+        fixtures.append((file_name, frame, labels[file_name]))
+    return fixtures
+
+def _read_fields(detected_text : str) -> dict:
+    try:
+        result = form_boiler_data(detected_text, _quiet_logger)
+    except (IndexError, ValueError):
+        return None
+    return {"time": result.marked_time.strftime("%H:%M"),
+            "mode": result.running_mode,
+            "temperature": result.temperature,
+            "burning": result.is_burning,
+            "valid": result.is_valid}
+
+def _peak_rss_mb() -> float:
+    # No Linux o ru_maxrss vem em KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench_engine(ocr_settings : dict, engine_name : str, fixtures : list, logger : logging.Logger, repeat : int = 1) -> dict:
+    ocr_engine = form_ocr_engine({**ocr_settings, "engine": engine_name}, logger)
+    regions = form_display_regions(ocr_settings.get("roi"), ocr_settings)
+    preprocessor = form_preprocessor(ocr_settings)
+
+    latencies = []
+    hits = {field: 0 for field in BENCH_FIELDS}
+    valid = 0
+    failures = []
+    try:
+        for run in range(repeat):
+            for file_name, frame, truth in fixtures:
+                # O mesmo caminho do ciclo run, sem câmara, sem cache e sem base de dados
+                started = time.perf_counter()
+                detected_text = extract_text(frame, False, ocr_engine, None, regions, preprocessor)
+                fields = _read_fields(detected_text)
+                latencies.append(time.perf_counter() - started)
+
+                if run > 0:
+                    continue
+                if fields is None:
+                    failures.append({"frame": file_name, "text": detected_text})
+                    continue
+                valid += fields["valid"]
+                wrong = [field for field in BENCH_FIELDS if fields[field] != truth.get(field, fields[field])]
+                for field in BENCH_FIELDS:
+                    hits[field] += field not in wrong
+                if wrong:
+                    failures.append({"frame": file_name, "text": detected_text, "fields": wrong})
+    finally:
+        ocr_engine.close()
+
+    latencies = np.array(latencies)
+    total = len(fixtures)
+    return {"engine": ocr_engine.name,
+            "frames": total,
+            "frames_per_second": round(len(latencies) / latencies.sum(), 2),
+            "latency_ms": {f"p{percentile}": round(float(np.percentile(latencies, percentile)) * 1000, 2)
+                           for percentile in (50, 95, 99)},
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+            "valid": round(valid / total, 4),
+            "accuracy": {field: round(hits[field] / total, 4) for field in BENCH_FIELDS},
+            "failures": failures}
+
+def compare_results(previous : dict, current : dict, logger : logging.Logger) -> bool:
+    # Falso se algum motor perdeu precisão num campo. Velocidade só é mostrada
+    regressed = False
+    previous_engines = {result["engine"]: result for result in previous["results"]}
+    for result in current["results"]:
+        before = previous_engines.get(result["engine"])
+        if before is None:
+            continue
+        logger.info(f"{result['engine']}: {before['frames_per_second']} -> {result['frames_per_second']} frames/s, "
+                    f"p95 {before['latency_ms']['p95']} -> {result['latency_ms']['p95']} ms")
+        for field in BENCH_FIELDS:
+            if result["accuracy"][field] < before["accuracy"][field]:
+                logger.error(f"{result['engine']} {field} accuracy dropped from {before['accuracy'][field]} to {result['accuracy'][field]}")
+                regressed = True
+    return not regressed
+
+def run_bench(ocr_settings : dict, frames_dir : str, engine_names : list[str], logger : logging.Logger, repeat : int = 1) -> dict:
+    fixtures = load_fixtures(frames_dir)
+    if len(fixtures) == 0:
+        raise ValueError(f"No labelled frames in {frames_dir}")
+    logger.info(f"Benchmarking {len(engine_names)} engines over {len(fixtures)} frames")
+
+    results = []
+    for engine_name in engine_names:
+        result = bench_engine(ocr_settings, engine_name, fixtures, logger, repeat)
+        logger.info(f"{result['engine']}: {result['frames_per_second']} frames/s, latency {result['latency_ms']}, "
+                    f"accuracy {result['accuracy']}, peak RSS {result['peak_rss_mb']} MB")
+        results.append(result)
+
+    return {"created": datetime.now().isoformat(timespec="seconds"),
+            "frames_dir": frames_dir,
+            "repeat": repeat,
+            "results": results}
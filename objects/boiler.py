@@ -1,103 +1,157 @@
 from datetime import datetime
+
+from objects.metrics import DEDUPE_SKIPS, FRAME_AGE, INVALID_READS, time_stage
+from objects.state import latest_state
+
 VALID_RUNNING_MODES = ["A", "1", "2", "3", "4", "5"]
 MAX_TEMPERATURE = 80
 MIN_TEMPERATURE = 25
 MIN_WORKING_TEMPERATURE = 53
 
+# Recortes (hora, minuto) da linha de cima conforme o comprimento e se o OCR meteu um espaço
+TIME_LAYOUTS = {
+    (4, False): (slice(0, 2), slice(2, 4)),
+    (5, True): (slice(0, 2), slice(3, 5)),
+    (5, False): (slice(1, 3), slice(3, 5)),
+    (6, True): (slice(1, 2), slice(5, 6)),
+    (6, False): (slice(1, 2), slice(5, 6))
+}
+
 class BoilerData:
-    def __init__(self, raw_data, logger, is_dry_run, db_handler):
+    """
+    Uma leitura do visor. Só os valores, sem logger nem base de dados. Quem grava é o BoilerRecorder.
+    """
+    __slots__ = ("marked_time", "is_burning", "running_mode", "temperature", "is_valid", "boiler_id")
+
+    def __init__(self, marked_time : datetime, is_burning : bool, running_mode : str, temperature : int, is_valid : bool, boiler_id : int = 1):
+        self.marked_time = marked_time
+        self.is_burning = is_burning
+        self.running_mode = running_mode
+        self.temperature = temperature
+        self.is_valid = is_valid
+        self.boiler_id = boiler_id
+
+def _form_marked_time(time_as_string : str, now : datetime, logger) -> datetime:
+    layout = TIME_LAYOUTS.get((len(time_as_string), " " in time_as_string))
+    if layout is None:
+        logger.warning(f"Couldn't form date given {time_as_string}. Assuming current datetime")
+        return now
+    try:
+        # Um só relógio para a leitura toda. Não há minutos trocados a meio
+        return now.replace(hour=int(time_as_string[layout[0]]), minute=int(time_as_string[layout[1]]), microsecond=0)
+    except ValueError:
+        logger.warning(f"Wrong value from OCR {time_as_string}. Assuming current datetime")
+        return now
+
+def form_boiler_data(raw_data : str, logger, boiler_id : int = 1, now : datetime = None) -> BoilerData:
+    # Um split e um datetime.now por leitura. Texto sem segunda linha dá IndexError como antes
+    lines = raw_data.splitlines()
+    top_row = lines[0].strip()
+    bottom_row = lines[1]
+    bottom_stripped = bottom_row.strip()
+    is_valid = True
+
+    is_burning = len(bottom_stripped) > 2
+
+    temperature = 0
+    try:
+        temperature = int(bottom_row.replace(" ", "")[-2:].strip() if is_burning else bottom_stripped)
+        if temperature > MAX_TEMPERATURE or temperature < MIN_TEMPERATURE:
+            logger.warning(f"Temperature {temperature} is out of bounds. Invalid run")
+            is_valid = False
+    except ValueError:
+        logger.error(f"Couldn't get proper temperature from ocr {raw_data}. Setting to 0.")
+
+    marked_time = _form_marked_time(top_row, datetime.now() if now is None else now, logger)
+
+    running_mode = "0"
+    if is_burning:
+        running_mode = bottom_row[0:1].strip()
+        # Tesseract thinks A is 8
+        if running_mode == "8":
+            running_mode = "A"
+        if running_mode not in VALID_RUNNING_MODES:
+            logger.warning(f"Couldn't get proper running mode from ocr {raw_data}. Invalid run")
+            is_valid = False
+
+    # Se os dados forem válidos avaliar o objeto como um todo. às vezes as combinações não fazem sentido
+    if is_valid and not is_burning and temperature > MIN_WORKING_TEMPERATURE:
+        logger.warning(f"Boiler is not burning but temperature is {temperature}. Invalid run.")
+        is_valid = False
+
+    return BoilerData(marked_time, is_burning, running_mode, temperature, is_valid, boiler_id)
+
+
+class BoilerRecorder:
+    """
+    Estado de uma caldeira entre ciclos. Guarda a última leitura gravada e se a caldeira está parada.
+    """
+    def __init__(self, logger, is_dry_run, db_handler, boiler_id=1):
         self.log = logger
-        self.is_valid = True
-        self.is_burning = self._form_is_burning(raw_data)
-        self.temperature = self._form_temperature(raw_data)
-        self.marked_time = self._form_marked_time(raw_data)
-        self.running_mode = self._form_running_mode(raw_data)
         self.dry_run = is_dry_run
         self.db_handler = db_handler
+        self.boiler_id = boiler_id
+        self.previous_record = None
+        self.stop_recording = False
+        # Última leitura vista, gravada ou não. O agendador usa-a para decidir o próximo intervalo
+        self.last_result = None
 
-        # Se os dados forem válidos avaliar o objeto como um todo. às vezes as combinações não fazem sentido
-        if self.is_valid == True:
-            self.validate()
-
-    def validate(self):
-        if self.is_burning == False and self.temperature > MIN_WORKING_TEMPERATURE:
-            self.is_valid = False
-            self.log.warning(f"Boiler is not burning but temperature is {self.temperature}. Invalid run.")
-            return
-         
-    def _form_is_burning(self, raw_data):
-        is_burning = False
-        bottom_row = raw_data.splitlines()[1].strip()            
-        if len(bottom_row) > 2:
-            is_burning = True
-        return is_burning
-    def _form_marked_time (self, raw_data):
-        time_as_string = raw_data.splitlines()[0].strip()
-        time_as_datetime = None
-        try:
-            if len(time_as_string) == 4 and time_as_string.find(" ") == -1:
-                return datetime(datetime.now().year, datetime.now().month, datetime.now().day, int(time_as_string[0:2]), int(time_as_string[2:4]), datetime.now().second)
-            elif len(time_as_string) == 5 and time_as_string.find(" ") > -1:
-                return datetime(datetime.now().year, datetime.now().month, datetime.now().day, int(time_as_string[0:2]), int(time_as_string[3:5]), datetime.now().second)
-            elif len(time_as_string) == 5 and time_as_string.find(" ") == -1:
-                return datetime(datetime.now().year, datetime.now().month, datetime.now().day, int(time_as_string[1:3]), int(time_as_string[3:5]), datetime.now().second)
-            elif len(time_as_string) == 6 and time_as_string.find(" ") > -1:
-                return datetime(datetime.now().year, datetime.now().month, datetime.now().day, int(time_as_string[1:2]), int(time_as_string[5:6]), datetime.now().second)
-            elif len(time_as_string) == 6 and time_as_string.find(" ") == -1:
-                return datetime(datetime.now().year, datetime.now().month, datetime.now().day, int(time_as_string[1:2]), int(time_as_string[5:6]), datetime.now().second)
-            else:
-                self.log.warning(f"Couldn't form date given {time_as_string}. Assuming current datetime")
-        except ValueError:
-            self.log.warning(f"Wrong value from OCR {time_as_string}. Assuming current datetime")
-
-        if time_as_datetime is None:
-            time_as_datetime = datetime.now()
-        return time_as_datetime
-    def _form_running_mode (self, raw_data) -> str:
-        running_mode = "0"
-        if self.is_burning == True:
-            mode_from_string = raw_data.splitlines()[1]
-            running_mode = mode_from_string[0:1].strip()
-
-            # Tesseract thinks A is 8
-            if running_mode == "8":
-                running_mode = "A"
-
-            if running_mode not in VALID_RUNNING_MODES:
-                self.log.warning(f"Couldn't get proper running mode from ocr {raw_data}. Invalid run")
-                self.is_valid = False
-        
-        return running_mode
-    def _form_temperature(self, raw_data):
-        try:
-            temperature_to_return = 0
-            temperature_as_string = raw_data.splitlines()
-            if self.is_burning:
-                temperature_to_return = int(temperature_as_string[1].replace(" ","")[-2:].strip())
-            else:                
-                temperature_to_return = int(temperature_as_string[1].strip())
-
-            if temperature_to_return > MAX_TEMPERATURE or temperature_to_return < MIN_TEMPERATURE:
-                self.log.warning(f"Temperature {temperature_to_return} is out of bounds. Invalid run")
-                self.is_valid = False
-
-        except ValueError as e:
-            self.log.error(f"Couldn't get proper temperature from ocr {raw_data}. Setting to 0.")
-        return temperature_to_return
-        
-    def persist_run(self):
+    def is_repeated(self, result : BoilerData) -> bool:
+        return self.previous_record is not None and (result.is_burning == self.previous_record.is_burning and 
+                result.temperature == self.previous_record.temperature and  
+                result.running_mode == self.previous_record.running_mode)
 
+    def persist(self, result : BoilerData):
         if self.dry_run is False and self.db_handler is None:
             self.log.error("Couldn't generate db string. Consider changing to dry run")
             self.dry_run = True
-        
+
         if self.dry_run:
-            burning = "No" if self.is_burning == False else "Yes"
-            self.log.info(f"Current status: Marked time - {self.marked_time}|Temperature - {self.temperature}|Running mode - {self.running_mode}|Burning - {burning}")
+            burning = "No" if result.is_burning == False else "Yes"
+            self.log.info(f"Current status: Marked time - {result.marked_time}|Temperature - {result.temperature}|Running mode - {result.running_mode}|Burning - {burning}")
             return
 
-        timestamp_inserted = self.db_handler.insert_record(self)
+        with time_stage("insert"):
+            timestamp_inserted = self.db_handler.insert_record(result)
         if timestamp_inserted:
             self.log.info(f"Inserted timestamp: {timestamp_inserted}")
         else:
             self.log.error(f"Insert failed due to constraint violation or error.")
+
+    def handle(self, detected_text : str, on_persist=None, frame_age : float = None):
+        # Instanciar. Validações estão dentro do objeto                
+        self.last_result = None
+        with time_stage("parse"):
+            result = form_boiler_data(detected_text, self.log, self.boiler_id)
+        self.last_result = result
+        # Em todos os modos e por caldeira. No supervisor cada câmara tem a sua série
+        if frame_age is not None:
+            FRAME_AGE.set(frame_age, boiler=self.boiler_id)
+        if result.is_valid == False:
+            INVALID_READS.inc(boiler=self.boiler_id)
+        else:
+            # O /state mostra a leitura mesmo quando não é gravada. frame_age é None se quem lê não o mediu
+            latest_state.update(result, frame_age, not self.is_repeated(result))
+
+        if self.is_repeated(result):
+            DEDUPE_SKIPS.inc(boiler=self.boiler_id)
+            self.log.debug("No significant change detected. Not persisting.")
+            return None
+
+        if result.is_burning == True and self.stop_recording == True:
+            self.log.info("Boiler is on again. Resuming persistence.")
+            self.stop_recording = False
+
+        # No pipeline a gravação é feita noutra thread. on_persist entrega-lhe o resultado
+        if result.is_valid == True and self.stop_recording == False:
+            if on_persist is None:
+                self.persist(result)
+            else:
+                on_persist(result)
+            self.previous_record = result
+
+        if result.is_burning == False and self.stop_recording == False:
+            self.log.info("Boiler is off. Not persisting until turned on.")
+            self.stop_recording = True                    
+
+        return result
@@ -0,0 +1,261 @@
+import logging
+import threading
+import time
+
+import cv2
+
+from objects.metrics import RECONNECTS, time_stage
+from objects.recording import FrameArchiveWriter, RecordingSource, ReplaySource
+
+CAMERA_CONNECTION_ATTEMPTS_LIMIT = 3
+
+# Tempos em milissegundos passados ao FFmpeg para não ficar pendurado num stream morto
+OPEN_TIMEOUT_MSEC = 5000
+READ_TIMEOUT_MSEC = 5000
+
+# Construir o endpoint para a fotografia
+def form_source_endpoint(ip : str, port : str) -> str:
+    endpoint = f"http://{ip}:{port}/video"
+    return endpoint
+
+def form_camera_source(camera_settings : dict):
+    # Sessão gravada no lugar da câmara, ou a câmara com gravação do que passa
+    if "replay" in camera_settings:
+        replay_settings = camera_settings["replay"]
+        # O grabber lê tão depressa quanto o arquivo deixa e guarda só o último. A velocidade 0 perdia quase tudo
+        if camera_settings.get("persistent", False) and replay_settings.get("speed", 1) <= 0:
+            raise ValueError("Replay speed 0 can't be used with a persistent camera. Use a positive speed or persistent false")
+        return ReplaySource(replay_settings["file"], replay_settings.get("speed", 1), replay_settings.get("loop", False))
+
+    endpoint = form_source_endpoint(camera_settings["connection"]["ip"], camera_settings["connection"]["port"])
+    if "record" not in camera_settings:
+        return endpoint
+
+    record_settings = camera_settings["record"]
+    writer = FrameArchiveWriter(record_settings["file"], record_settings.get("format", ".jpg"),
+                                record_settings.get("quality", 90), record_settings.get("fps", 5))
+    return RecordingSource(endpoint, writer, _open_endpoint)
+
+def close_camera_source(source):
+    if hasattr(source, "close"):
+        source.close()
+
+def form_frame_grabber(source : str, camera_settings : dict, logger : logging.Logger):
+    return FrameGrabber(source, logger,
+                        camera_settings.get("reconnect-delay", 1),
+                        camera_settings.get("max-reconnect-delay", 60),
+                        camera_settings.get("stall-timeout", 10))
+
+def _open_endpoint(endpoint : str):
+    return cv2.VideoCapture(endpoint, cv2.CAP_FFMPEG, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, OPEN_TIMEOUT_MSEC,
+                                                       cv2.CAP_PROP_READ_TIMEOUT_MSEC, READ_TIMEOUT_MSEC])
+
+def connect(source):
+    with time_stage("connect"):
+        # Fontes de form_camera_source que não são um URL sabem abrir-se sozinhas
+        if hasattr(source, "open"):
+            return source.open()
+        return _open_endpoint(source)
+
+class FrameGrabber:
+    """
+    Mantém o stream da câmara aberto numa thread e guarda apenas o frame mais recente.
+    Se o stream parar, volta a ligar com backoff exponencial.
+    """
+    def __init__(self, source : str, logger : logging.Logger, reconnect_delay : float = 1, max_reconnect_delay : float = 60, stall_timeout : float = 10):
+        self.source = source
+        self.log = logger
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.stall_timeout = stall_timeout
+        self.reconnects = 0
+        # Sessão gravada que chegou ao fim. O último frame ainda é entregue uma vez
+        self.finished = False
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._frame = None
+        self._frame_time = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="frame-grabber", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=(READ_TIMEOUT_MSEC / 1000) + 1)
+            self._thread = None
+
+    @property
+    def frame_age(self):
+        with self._lock:
+            if self._frame_time is None:
+                return None
+            return time.monotonic() - self._frame_time
+
+    def read(self):
+        # Mesma assinatura do VideoCapture.read para o ciclo principal não notar a diferença
+        with self._lock:
+            if self._frame is None:
+                return False, None
+            frame_age = time.monotonic() - self._frame_time
+            if frame_age > self.stall_timeout:
+                return False, None
+            frame = self._frame
+            if self.finished:
+                self._frame = None
+            return True, frame
+
+    def _source_finished(self) -> bool:
+        # Uma sessão gravada no fim não volta. Pára aqui em vez de tentar ligar para sempre
+        if not getattr(self.source, "finished", False):
+            return False
+        self.log.info(f"Replay of {self.source} finished")
+        self.finished = True
+        return True
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while not self._stop_event.is_set():
+            capture = connect(self.source)
+            if not capture.isOpened():
+                capture.release()
+                if self._source_finished():
+                    return
+                RECONNECTS.inc()
+                self.log.warning(f"Couldn't open video feed {self.source}. Retrying in {delay}s")
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            self.log.debug(f"Persistent capture connected to {self.source}")
+            capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            delay = self.reconnect_delay
+
+            while not self._stop_event.is_set():
+                ret, frame = capture.read()
+                if not ret:
+                    break
+                # Troca a referência, o frame anterior é descartado
+                with self._lock:
+                    self._frame = frame
+                    self._frame_time = time.monotonic()
+
+            capture.release()
+            if self._stop_event.is_set() or self._source_finished():
+                return
+            self.log.warning("Video feed stalled. Reconnecting.")
+            self.reconnects += 1
+            RECONNECTS.inc()
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+class FrameSource:
+    """
+    Dá um frame de cada vez, com o stream sempre aberto ou a ligar e desligar por frame.
+    Sem frame devolve None. No modo por frame isso quer dizer que desistiu.
+    """
+    def __init__(self, source : str, camera_settings : dict, logger : logging.Logger, stop_event : threading.Event = None):
+        self.source = source
+        self.log = logger
+        self.is_persistent = camera_settings.get("persistent", False)
+        self._grabber = form_frame_grabber(source, camera_settings, logger) if self.is_persistent else None
+        self._stop_event = stop_event if stop_event is not None else threading.Event()
+        # Frames seguidos por amostra para votar. Um só é o comportamento antigo
+        self.burst = max(1, camera_settings.get("burst", 1))
+        self.burst_interval = camera_settings.get("burst-interval", 0.05)
+
+    @property
+    def frame_age(self):
+        return None if self._grabber is None else self._grabber.frame_age
+
+    @property
+    def finished(self) -> bool:
+        # Sessão gravada que chegou ao fim. Não adianta esperar nem voltar a ligar
+        if self._grabber is not None:
+            return self._grabber.finished
+        return getattr(self.source, "finished", False)
+
+    def capture_time(self) -> float:
+        # Instante monotónico do frame acabado de ler. Persistente o grabber já o tinha há frame_age segundos
+        frame_age = self.frame_age
+        return time.monotonic() - (frame_age or 0)
+
+    def start(self):
+        if self._grabber is not None:
+            self._grabber.start()
+
+    def stop(self):
+        if self._grabber is not None:
+            self._grabber.stop()
+        close_camera_source(self.source)
+
+    def read(self):
+        if self._grabber is not None:
+            ret, frame = self._grabber.read()
+            return frame if ret else None
+
+        # O smartphone fazia timeout se o objeto estivesse sempre instanciado
+        for attempt in range(CAMERA_CONNECTION_ATTEMPTS_LIMIT):
+            capture = connect(self.source)
+            if capture.isOpened():
+                with time_stage("read"):
+                    ret, frame = capture.read()
+                capture.release()
+                return frame if ret else None
+
+            capture.release()
+            if self.finished:
+                return None
+            RECONNECTS.inc()
+            self.log.warning(f"Couldn't open video feed. Retrying: {attempt + 1}")
+            if self._stop_event.wait(5):
+                return None
+        return None
+
+    def read_burst(self) -> list:
+        # Lista vazia quer dizer o mesmo que o None do read
+        if self.burst == 1:
+            frame = self.read()
+            return [] if frame is None else [frame]
+
+        if self._grabber is not None:
+            frames = []
+            for index in range(self.burst):
+                ret, frame = self._grabber.read()
+                # O grabber pode ainda não ter trocado de frame. Repetidos não acrescentam votos
+                if ret and not any(frame is previous for previous in frames):
+                    frames.append(frame)
+                if index + 1 < self.burst and self._stop_event.wait(self.burst_interval):
+                    break
+            return frames
+
+        for attempt in range(CAMERA_CONNECTION_ATTEMPTS_LIMIT):
+            capture = connect(self.source)
+            if capture.isOpened():
+                # Uma só ligação para o burst inteiro
+                frames = []
+                for index in range(self.burst):
+                    with time_stage("read"):
+                        ret, frame = capture.read()
+                    if not ret:
+                        break
+                    frames.append(frame)
+                    if index + 1 < self.burst and self._stop_event.wait(self.burst_interval):
+                        break
+                capture.release()
+                return frames
+
+            capture.release()
+            if self.finished:
+                return []
+            RECONNECTS.inc()
+            self.log.warning(f"Couldn't open video feed. Retrying: {attempt + 1}")
+            if self._stop_event.wait(5):
+                return []
+        return []
@@ -0,0 +1,225 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Segundos. Cobre desde o parse (microssegundos) até um connect que chega ao timeout
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_labels(labels : tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram, labels : tuple):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram._observe(self._labels, time.perf_counter() - self._started)
+        return False
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name : str, help_text : str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount : float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value : float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+class Histogram:
+    """
+    Contagens cumulativas por bucket, soma e total. Observar é um bisect e três somas debaixo de um lock.
+    """
+    kind = "histogram"
+
+    def __init__(self, name : str, help_text : str, buckets : tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds : float, **labels):
+        self._observe(tuple(sorted(labels.items())), seconds)
+
+    def _observe(self, key : tuple, seconds : float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Um contador por bucket mais o +Inf, soma e total
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += seconds
+            state[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        return _Timer(self, tuple(sorted(labels.items())))
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+
+        samples = []
+        for key, counts, total_seconds, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", key + (("le", bound),), cumulative))
+            samples.append((f"{self.name}_sum", key, total_seconds))
+            samples.append((f"{self.name}_count", key, total))
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_class, name : str, help_text : str):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, help_text)
+            return self._metrics[name]
+
+    def counter(self, name : str, help_text : str = "") -> Counter:
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name : str, help_text : str = "") -> Gauge:
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name : str, help_text : str = "") -> Histogram:
+        return self._get(Histogram, name, help_text)
+
+    def render(self) -> str:
+        # Formato de texto do Prometheus
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+# Registo do processo. Os módulos escrevem aqui mesmo sem servidor, o custo é o mesmo ligado ou não
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("boiler_stage_seconds", "Time spent in each stage of a sampling cycle")
+INVALID_READS = registry.counter("boiler_invalid_reads_total", "OCR readings rejected by BoilerData validation")
+DEDUPE_SKIPS = registry.counter("boiler_dedupe_skips_total", "Readings not persisted because nothing changed")
+OCR_CACHE_HITS = registry.counter("boiler_ocr_cache_hits_total", "Frames answered by the change gate without OCR")
+RECONNECTS = registry.counter("boiler_camera_reconnects_total", "Failed camera connections and stalled streams")
+DB_ERRORS = registry.counter("boiler_db_errors_total", "Database statements that failed")
+DB_RETRIES = registry.counter("boiler_db_retries_total", "Database operations repeated after a lost connection")
+DB_DISCONNECTS = registry.counter("boiler_db_disconnects_total", "Pooled connections found dead and replaced")
+DB_POOL_CHECKED_OUT = registry.gauge("boiler_db_pool_checked_out", "Connections currently taken from the pool")
+FRAME_AGE = registry.gauge("boiler_frame_age_seconds", "Age of the frame behind the latest reading, from capture to parse")
+
+def time_stage(stage : str) -> _Timer:
+    return STAGE_SECONDS.time(stage=stage)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsExporter:
+    """
+    Expõe o registo num /metrics local ou escreve-o num ficheiro para o textfile collector do node_exporter.
+    """
+    def __init__(self, metrics_settings : dict, logger : logging.Logger):
+        self.log = logger
+        self.port = metrics_settings.get("port")
+        self.host = metrics_settings.get("host", "127.0.0.1")
+        self.textfile = metrics_settings.get("textfile")
+        self.interval = metrics_settings.get("interval", 15)
+        self._server = None
+        self._thread = None
+        self._next_write = 0
+
+    def start(self):
+        if self.port is None:
+            return
+        self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        self.log.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    def write_textfile(self):
+        # Escreve para um temporário e troca. O collector nunca lê um ficheiro a meio
+        temporary_file = f"{self.textfile}.tmp"
+        with open(temporary_file, "w") as file:
+            file.write(registry.render())
+        os.replace(temporary_file, self.textfile)
+
+    def tick(self):
+        if self.textfile is None:
+            return
+        now = time.monotonic()
+        if now < self._next_write:
+            return
+        self._next_write = now + self.interval
+        try:
+            self.write_textfile()
+        except OSError as e:
+            self.log.warning(f"Couldn't write metrics to {self.textfile}: {e}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.textfile is not None:
+            self._next_write = 0
+            self.tick()
+
+def form_metrics_exporter(app_settings : dict, logger : logging.Logger):
+    if "metrics" not in app_settings:
+        return None
+    exporter = MetricsExporter(app_settings["metrics"], logger)
+    exporter.start()
+    return exporter
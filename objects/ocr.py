@@ -0,0 +1,303 @@
+import logging
+import signal
+
+import cv2
+import numpy as np
+import pytesseract
+
+from objects.metrics import OCR_CACHE_HITS, time_stage
+from objects.segments import SevenSegmentEngine
+from objects.voting import vote_text
+
+TESSERACT_LANG = "lets"
+TESSERACT_OEM = 3
+TESSERACT_PSM = 6
+TESSERACT_WHITELIST = "aA1234567890"
+# Uma linha para a hora e a temperatura, uma palavra para o dígito do modo
+PSM_SINGLE_LINE = 7
+PSM_SINGLE_WORD = 8
+
+ROI_FIELDS = {"time": PSM_SINGLE_LINE, "mode": PSM_SINGLE_WORD, "temperature": PSM_SINGLE_LINE}
+
+# Tamanho para onde a imagem é reduzida antes de comparar. Chega para ver os dígitos a mudar
+GATE_SIZE = (64, 32)
+
+# O visor aceso fica a preto (0) sobre fundo cinzento (200). O motor de segmentos conta com isto
+THRESHOLD_LEVEL = 230
+THRESHOLD_BACKGROUND = 200
+# O RGBA2GRAY original trata o frame BGR do VideoCapture como RGB. O limite 230 foi afinado assim
+GRAY_CODES = {("rgb", 3): cv2.COLOR_RGB2GRAY, ("rgb", 4): cv2.COLOR_RGBA2GRAY,
+              ("bgr", 3): cv2.COLOR_BGR2GRAY, ("bgr", 4): cv2.COLOR_BGRA2GRAY}
+
+class FrameChangeGate:
+    """
+    Compara a imagem já processada com a última que passou pelo OCR.
+    Se a diferença média for menor que o limite, devolve o texto anterior e poupa o Tesseract.
+    """
+    def __init__(self, threshold : float):
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.cached_text = None
+        self._reference = None
+
+    def _reduce(self, image):
+        return cv2.resize(image, GATE_SIZE, interpolation=cv2.INTER_AREA)
+
+    def difference(self, image) -> float:
+        if self._reference is None:
+            return float("inf")
+        return float(np.mean(cv2.absdiff(self._reduce(image), self._reference)))
+
+    def is_unchanged(self, image) -> bool:
+        if self.cached_text is not None and self.difference(image) < self.threshold:
+            self.hits += 1
+            OCR_CACHE_HITS.inc()
+            return True
+        self.misses += 1
+        return False
+
+    def update(self, image, text : str):
+        self._reference = self._reduce(image)
+        self.cached_text = text
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return 0.0 if total == 0 else self.hits / total
+
+class FramePreprocessor:
+    """
+    Passa o recorte do visor a preto e branco para o OCR, reaproveitando os buffers de um frame para o outro.
+    Pode reduzir a imagem antes do limiar e usar Otsu ou um limiar adaptativo em vez do valor fixo.
+    Um por thread. Os buffers não são partilháveis.
+    """
+    def __init__(self, preprocess_settings : dict = None):
+        preprocess_settings = preprocess_settings or {}
+        self.color_order = preprocess_settings.get("color-order", "rgb")
+        self.scale = preprocess_settings.get("scale", 1)
+        self.threshold = preprocess_settings.get("threshold", "fixed")
+        self.level = preprocess_settings.get("level", THRESHOLD_LEVEL)
+        self.block_size = preprocess_settings.get("block-size", 31)
+        self.offset = preprocess_settings.get("offset", 10)
+        self._buffers = {}
+
+    def _buffer(self, name : str, shape : tuple):
+        # Só volta a alocar se o tamanho do recorte mudar
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def _to_gray(self, image):
+        if image.ndim == 2:
+            return image
+        return cv2.cvtColor(image, GRAY_CODES[(self.color_order, image.shape[2])], dst=self._buffer("gray", image.shape[:2]))
+
+    def _downscale(self, gray):
+        if self.scale == 1:
+            return gray
+        height, width = gray.shape
+        size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+        return cv2.resize(gray, size, dst=self._buffer("scaled", (size[1], size[0])), interpolation=cv2.INTER_AREA)
+
+    def process(self, image, keep : bool = True):
+        # Com keep=False devolve o buffer interno, que o próximo frame reescreve
+        gray = self._downscale(self._to_gray(image))
+        output = np.empty(gray.shape, dtype=np.uint8) if keep else self._buffer("output", gray.shape)
+
+        if self.threshold == "otsu":
+            cv2.threshold(gray, 0, THRESHOLD_BACKGROUND, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU, dst=output)
+        elif self.threshold == "adaptive":
+            cv2.adaptiveThreshold(gray, THRESHOLD_BACKGROUND, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV,
+                                  self.block_size, self.offset, dst=output)
+        else:
+            cv2.threshold(gray, self.level, THRESHOLD_BACKGROUND, cv2.THRESH_BINARY_INV, dst=output)
+        return output
+
+def form_preprocessor(ocr_settings : dict) -> FramePreprocessor:
+    return FramePreprocessor(ocr_settings.get("preprocess"))
+
+def form_display_regions(roi_settings : dict, ocr_settings : dict):
+    if roi_settings is None:
+        return None
+    return DisplayRegions(roi_settings, ocr_settings.get("preprocess", {}).get("scale", 1))
+
+class PyTesseractEngine:
+    """
+    Chama o binário do tesseract para cada frame. Mais lento mas não precisa de bindings.
+    """
+    name = "pytesseract"
+    # Ler a confiança obrigava a uma segunda passagem do tesseract. Todas as leituras valem o mesmo
+    text_confidence = 1.0
+
+    def __init__(self, tesseract_cmd : str = None, lang : str = TESSERACT_LANG, psm : int = TESSERACT_PSM):
+        if tesseract_cmd is not None:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self.lang = lang
+        self.psm = psm
+        self.confidences = []
+
+    def recognize(self, image, psm : int = None) -> str:
+        config = f"--oem {TESSERACT_OEM} --psm {psm or self.psm} -c tessedit_char_whitelist={TESSERACT_WHITELIST}"
+        return pytesseract.image_to_string(image, lang=self.lang, config=config).strip()
+
+    def close(self):
+        pass
+
+class TesserOCREngine:
+    """
+    Mantém uma instância da API do Tesseract viva. O traineddata e as variáveis
+    são carregados uma vez e a imagem passa directamente da memória.
+    """
+    name = "tesserocr"
+
+    def __init__(self, tessdata_dir : str = None, lang : str = TESSERACT_LANG, psm : int = TESSERACT_PSM):
+        import tesserocr
+
+        self._api = tesserocr.PyTessBaseAPI(path=tessdata_dir, lang=lang, oem=TESSERACT_OEM, psm=psm) if tessdata_dir \
+            else tesserocr.PyTessBaseAPI(lang=lang, oem=TESSERACT_OEM, psm=psm)
+        self._api.SetVariable("tessedit_char_whitelist", TESSERACT_WHITELIST)
+        self.psm = psm
+        self.confidences = []
+        self.text_confidence = 0.0
+
+    def recognize(self, image, psm : int = None) -> str:
+        self._api.SetPageSegMode(psm or self.psm)
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        self._api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        text = self._api.GetUTF8Text().strip()
+        self.text_confidence = self._api.MeanTextConf() / 100
+        return text
+
+    def close(self):
+        if self._api is not None:
+            self._api.End()
+            self._api = None
+
+class DisplayRegions:
+    """
+    Rectângulos [x, y, largura, altura] do visor e de cada campo, vindos das definições.
+    Os campos são relativos ao recorte do visor. Se a imagem for reduzida antes do OCR os campos também são.
+    """
+    def __init__(self, roi_settings : dict, scale : float = 1):
+        self.display = tuple(roi_settings["display"]) if "display" in roi_settings else None
+        self.fields = {name: tuple(int(round(value * scale)) for value in roi_settings[name])
+                       for name in ROI_FIELDS if name in roi_settings}
+        self.text_confidence = 0.0
+
+    @staticmethod
+    def _crop(image, rect):
+        # Slicing devolve uma vista, não copia o frame
+        x, y, width, height = rect
+        return image[y:y + height, x:x + width]
+
+    def crop_display(self, image):
+        if self.display is None:
+            return image
+        return self._crop(image, self.display)
+
+    def read_fields(self, image, ocr_engine) -> str:
+        fields = {}
+        confidences = []
+        for name, rect in self.fields.items():
+            fields[name] = ocr_engine.recognize(self._crop(image, rect), ROI_FIELDS[name]).replace(" ", "")
+            confidences.append(ocr_engine.text_confidence)
+        self.text_confidence = sum(confidences) / len(confidences)
+
+        # Devolve o mesmo formato de duas linhas que o BoilerData já lê. Sem modo a caldeira está parada
+        bottom_row = fields.get("temperature", "")
+        if fields.get("mode"):
+            bottom_row = f"{fields['mode'][0:1]} {bottom_row}"
+        return f"{fields.get('time', '')}\n{bottom_row}"
+
+def form_ocr_engine(ocr_settings : dict, logger : logging.Logger):
+    engine_name = ocr_settings.get("engine", TesserOCREngine.name)
+
+    if engine_name == TesserOCREngine.name:
+        try:
+            return TesserOCREngine(ocr_settings.get("tessdata-dir"))
+        except (ImportError, RuntimeError) as e:
+            logger.warning(f"Couldn't start tesserocr ({e}). Falling back to pytesseract")
+    elif engine_name == SevenSegmentEngine.name:
+        return SevenSegmentEngine(ocr_settings.get("glyphs-dir"))
+    elif engine_name != PyTesseractEngine.name:
+        logger.warning(f"Unknown OCR engine {engine_name}. Using pytesseract")
+
+    return PyTesseractEngine(ocr_settings.get("tesseract-dir"))
+
+def process_image(image, is_debug, preprocessor : FramePreprocessor = None, keep : bool = True):
+    # A janela de debug fica fora do tempo medido. O waitKey espera por uma tecla
+    with time_stage("preprocess"):
+        if preprocessor is None:
+            gray_frame = cv2.cvtColor(image, cv2.COLOR_RGBA2GRAY)
+            ret, image_to_test = cv2.threshold(gray_frame, THRESHOLD_LEVEL, THRESHOLD_BACKGROUND, cv2.THRESH_BINARY_INV)
+        else:
+            image_to_test = preprocessor.process(image, keep)
+    if is_debug == True:
+        cv2.imshow("Debug window", image_to_test)
+        cv2.waitKey(0)
+
+    return image_to_test
+
+def recognize_image(image_to_parse, ocr_engine, regions=None) -> str:
+    with time_stage("ocr"):
+        if regions is not None and regions.fields:
+            return regions.read_fields(image_to_parse, ocr_engine)
+        return ocr_engine.recognize(image_to_parse)
+
+def recognize_with_confidence(image_to_parse, ocr_engine, regions=None) -> tuple[str, float]:
+    text = recognize_image(image_to_parse, ocr_engine, regions)
+    if regions is not None and regions.fields:
+        return text, regions.text_confidence
+    return text, ocr_engine.text_confidence
+
+def prepare_image(frame, is_debug, regions=None, preprocessor : FramePreprocessor = None, keep : bool = True):
+    # Só interessa o visor. O resto do frame é trabalho perdido. O recorte é uma vista, não uma cópia
+    if regions is not None:
+        frame = regions.crop_display(frame)
+    return process_image(frame, is_debug, preprocessor, keep)
+
+def extract_text_burst(frames, is_debug, ocr_engine, change_gate=None, regions=None, preprocessor : FramePreprocessor = None):
+    # Vários frames seguidos do mesmo visor. Cada campo é decidido por voto pesado pela confiança
+    if len(frames) == 1:
+        return extract_text(frames[0], is_debug, ocr_engine, change_gate, regions, preprocessor)
+
+    images = [prepare_image(frame, is_debug, regions, preprocessor) for frame in frames]
+    if change_gate is not None and change_gate.is_unchanged(images[0]):
+        return change_gate.cached_text
+
+    text = vote_text([recognize_with_confidence(image, ocr_engine, regions) for image in images])
+
+    if change_gate is not None:
+        change_gate.update(images[0], text)
+    return text
+
+def extract_text(frame, is_debug, ocr_engine, change_gate=None, regions=None, preprocessor : FramePreprocessor = None):
+    # A imagem não sai daqui. Pode ficar no buffer do preprocessor
+    image_to_parse = prepare_image(frame, is_debug, regions, preprocessor, keep=False)
+
+    # O visor raramente muda. Se a imagem for igual à última analisada não vale a pena chamar o Tesseract
+    if change_gate is not None and change_gate.is_unchanged(image_to_parse):
+        return change_gate.cached_text
+
+    text = recognize_image(image_to_parse, ocr_engine, regions)
+
+    if change_gate is not None:
+        change_gate.update(image_to_parse, text)
+    return text
+
+# Motor de cada processo do pool de OCR. Criado uma vez quando o processo arranca
+_process_engine = None
+
+def init_ocr_process(ocr_settings : dict):
+    global _process_engine
+    # Quem pára os processos é o supervisor. O SIGTERM/CTRL+C do grupo não os pode partir a meio
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _process_engine = form_ocr_engine(ocr_settings, logging.getLogger("Boiler OCR - ocr"))
+
+def recognize_in_process(image_to_parse, roi_settings : dict = None, scale : float = 1) -> tuple[str, float]:
+    regions = None if roi_settings is None else DisplayRegions(roi_settings, scale)
+    return recognize_with_confidence(image_to_parse, _process_engine, regions)
@@ -0,0 +1,215 @@
+import logging
+import queue
+import threading
+import time
+
+from objects.boiler import BoilerRecorder
+from objects.camera import OPEN_TIMEOUT_MSEC, READ_TIMEOUT_MSEC, FrameSource
+from objects.ocr import DisplayRegions, FrameChangeGate, FramePreprocessor, prepare_image, recognize_with_confidence
+from objects.scheduler import AdaptiveScheduler
+from objects.voting import vote_text
+
+PIPELINE_STAGES = ("capture", "preprocess", "ocr", "parse", "persist")
+QUEUE_TIMEOUT = 0.5
+# Uma ligação por frame pode estar presa no open e no read do FFmpeg quando o stop chega
+CAPTURE_JOIN_TIMEOUT = (OPEN_TIMEOUT_MSEC + READ_TIMEOUT_MSEC) / 1000 + 1
+
+class StageStats:
+    __slots__ = ("processed", "total_seconds", "max_seconds", "last_seconds")
+
+    def __init__(self):
+        self.processed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+
+    def record(self, seconds : float):
+        self.processed += 1
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def as_dict(self) -> dict:
+        average = 0.0 if self.processed == 0 else self.total_seconds / self.processed
+        return {"processed": self.processed,
+                "avg_ms": round(average * 1000, 2),
+                "max_ms": round(self.max_seconds * 1000, 2),
+                "last_ms": round(self.last_seconds * 1000, 2)}
+
+class DropOldestQueue(queue.Queue):
+    # Quando está cheia deita fora o item mais antigo em vez de bloquear quem mete
+    def __init__(self, maxsize : int):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put_latest(self, item):
+        with self.not_full:
+            if self.maxsize > 0 and self._qsize() >= self.maxsize:
+                self._get()
+                self.dropped += 1
+            else:
+                self.unfinished_tasks += 1
+            self._put(item)
+            self.not_empty.notify()
+
+class CapturePipeline:
+    """
+    Captura, preparação, OCR, parse e gravação em threads separadas ligadas por filas limitadas.
+    A captura corre ao período do agendador, por isso o tempo de OCR não atrasa a amostragem.
+    O OCR só trabalha o frame mais recente. Se ficar para trás os antigos são descartados.
+    """
+    def __init__(self, source, camera_settings : dict, ocr_engine, recorder : BoilerRecorder, logger : logging.Logger,
+                 scheduler : AdaptiveScheduler, regions : DisplayRegions = None, change_gate : FrameChangeGate = None,
+                 queue_size : int = 4, stats_interval : float = 60, preprocessor : FramePreprocessor = None):
+        self._stop_event = threading.Event()
+        # O stop também interrompe as esperas entre tentativas de ligação do modo por frame
+        self.frame_source = FrameSource(source, camera_settings, logger, self._stop_event)
+        self.ocr_engine = ocr_engine
+        self.recorder = recorder
+        self.log = logger
+        self.scheduler = scheduler
+        self.regions = regions
+        self.change_gate = change_gate
+        self.preprocessor = preprocessor
+        self.stats_interval = stats_interval
+        self.failed = False
+
+        self._frames = queue.Queue(queue_size)
+        self._images = DropOldestQueue(1)
+        self._texts = queue.Queue(queue_size)
+        self._results = queue.Queue(queue_size)
+        self.queues = {"preprocess": self._frames, "ocr": self._images, "parse": self._texts, "persist": self._results}
+        self.stats = {stage: StageStats() for stage in PIPELINE_STAGES}
+
+        # Cada etapa só pára depois da anterior ter terminado e da sua fila estar vazia
+        self._drain_events = {stage: threading.Event() for stage in self.queues}
+        self._threads = []
+
+    def snapshot(self) -> dict:
+        stages = {}
+        for stage in PIPELINE_STAGES:
+            stages[stage] = self.stats[stage].as_dict()
+            if stage in self.queues:
+                stages[stage]["depth"] = self.queues[stage].qsize()
+        stages["ocr"]["dropped"] = self._images.dropped
+        return stages
+
+    def _put(self, target : queue.Queue, item):
+        # Bloqueia quando a fila está cheia. É a contrapressão sobre a etapa anterior
+        target.put(item)
+
+    def _consume(self, stage : str, source : queue.Queue, work):
+        # Depois do stop ainda esvazia a fila para não perder leituras já feitas
+        drain_event = self._drain_events[stage]
+        while not (drain_event.is_set() and source.empty()):
+            try:
+                item = source.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                continue
+            started = time.perf_counter()
+            try:
+                work(item)
+            except Exception as e:
+                self.log.warning(f"Pipeline stage {stage} failed: {e}")
+            self.stats[stage].record(time.perf_counter() - started)
+
+    def _capture(self):
+        next_tick = time.monotonic()
+        next_stats = next_tick + self.stats_interval
+        while not self._stop_event.is_set():
+            started = time.perf_counter()
+            frames = self.frame_source.read_burst()
+            self.stats["capture"].record(time.perf_counter() - started)
+
+            if frames:
+                self._put(self._frames, (self.frame_source.capture_time(), frames))
+            elif self._stop_event.is_set():
+                return
+            elif self.frame_source.finished:
+                self.log.info("Replay finished")
+                self._stop_event.set()
+                return
+            elif not self.frame_source.is_persistent:
+                self.log.critical("Couldn't read from video feed. Giving up.")
+                self.failed = True
+                self._stop_event.set()
+                return
+            else:
+                self.log.warning("No recent frame available. Waiting for the video feed.")
+
+            now = time.monotonic()
+            if now >= next_stats:
+                self.log.info(f"Pipeline stats: {self.snapshot()}")
+                next_stats = now + self.stats_interval
+
+            # Período fixo. Se a captura se atrasou salta os ticks perdidos em vez de acumular
+            next_tick += self.scheduler.interval
+            if next_tick < now:
+                next_tick = now
+            self._stop_event.wait(next_tick - now)
+
+    def _preprocess(self, item):
+        captured_at, frames = item
+        # Sem janelas de debug. O imshow não funciona fora da thread principal
+        # As imagens seguem para outra thread. Não podem ficar no buffer do preprocessor
+        images = [prepare_image(frame, False, self.regions, self.preprocessor) for frame in frames]
+        self._images.put_latest((captured_at, images))
+
+    def _ocr(self, item):
+        captured_at, images = item
+        # O cache só é lido e escrito nesta thread. Os acertos seguem pela mesma fila, pela ordem dos frames
+        if self.change_gate is not None and self.change_gate.is_unchanged(images[0]):
+            self._put(self._texts, (captured_at, self.change_gate.cached_text))
+            return
+        text = vote_text([recognize_with_confidence(image, self.ocr_engine, self.regions) for image in images])
+        if self.change_gate is not None:
+            self.change_gate.update(images[0], text)
+        self._put(self._texts, (captured_at, text))
+
+    def _parse(self, item):
+        captured_at, detected_text = item
+        self.log.debug(f"Detected Text: {detected_text}")
+        try:
+            self.recorder.handle(detected_text, lambda result: self._put(self._results, result),
+                                 time.monotonic() - captured_at)
+        except Exception as e:
+            self.log.warning(f"Failed while forming the log. Retrying in the next cycle {e}. OCR is {detected_text}")
+        self.scheduler.observe(self.recorder.last_result, self.recorder.stop_recording)
+
+    def _persist(self, result):
+        self.recorder.persist(result)
+
+    def start(self):
+        self.frame_source.start()
+        workers = [("capture", self._capture),
+                   ("preprocess", lambda: self._consume("preprocess", self._frames, self._preprocess)),
+                   ("ocr", lambda: self._consume("ocr", self._images, self._ocr)),
+                   ("parse", lambda: self._consume("parse", self._texts, self._parse)),
+                   ("persist", lambda: self._consume("persist", self._results, self._persist))]
+        for name, target in workers:
+            thread = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            self._threads.append((name, thread))
+
+    def wait(self, on_tick=None, interval : float = 1):
+        while not self._stop_event.is_set():
+            if on_tick is not None:
+                on_tick()
+            self._stop_event.wait(interval)
+
+    def stop(self):
+        self._stop_event.set()
+        # Pela ordem das etapas, para cada uma esvaziar o que a anterior deixou
+        for name, thread in self._threads:
+            if name in self._drain_events:
+                self._drain_events[name].set()
+            if name == "capture":
+                thread.join(timeout=CAPTURE_JOIN_TIMEOUT)
+                if thread.is_alive():
+                    self.log.warning("Capture still waiting for the video feed. Stopping without it")
+                continue
+            thread.join()
+        self._threads = []
+        self.frame_source.stop()
+        self.log.info(f"Pipeline stopped. Stats: {self.snapshot()}")
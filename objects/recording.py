@@ -0,0 +1,222 @@
+import bisect
+import mmap
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Arquivo de frames. Imagens codificadas umas a seguir às outras e um índice em texto ao lado
+ARCHIVE_EXTENSION = ".frames"
+INDEX_EXTENSION = ".index"
+
+class FrameArchiveWriter:
+    """
+    Grava frames para um arquivo. Cada linha do índice tem o instante, o offset e o tamanho do frame.
+    O índice só é escrito depois da imagem, por isso uma sessão interrompida continua legível.
+    """
+    def __init__(self, file_name : str, image_format : str = ".jpg", quality : int = 90, max_fps : float = 5):
+        self.file_name = file_name
+        self.image_format = image_format
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality] if image_format in (".jpg", ".jpeg") else []
+        self.min_gap = 0 if not max_fps else 1 / max_fps
+        self.written = 0
+        self._last_written = None
+        self._lock = threading.Lock()
+        self._data = open(file_name, "ab")
+        self._index = open(file_name + INDEX_EXTENSION, "a", buffering=1)
+
+    def write(self, frame, timestamp : float = None):
+        timestamp = time.time() if timestamp is None else timestamp
+        # O stream persistente dá frames a 30 fps. Chega guardar ao ritmo de amostragem
+        if self._last_written is not None and timestamp - self._last_written < self.min_gap:
+            return
+        ret, encoded = cv2.imencode(self.image_format, frame, self.encode_params)
+        if not ret:
+            return
+
+        with self._lock:
+            if self._data.closed:
+                return
+            offset = self._data.tell()
+            self._data.write(encoded.tobytes())
+            self._data.flush()
+            self._index.write(f"{timestamp:.3f} {offset} {len(encoded)}\n")
+            self._last_written = timestamp
+            self.written += 1
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._index.close()
+
+class RecordingCapture:
+    # VideoCapture que grava cada frame lido
+    def __init__(self, capture, writer : FrameArchiveWriter):
+        self._capture = capture
+        self._writer = writer
+
+    def isOpened(self) -> bool:
+        return self._capture.isOpened()
+
+    def set(self, prop_id, value):
+        return self._capture.set(prop_id, value)
+
+    def read(self):
+        ret, frame = self._capture.read()
+        if ret:
+            self._writer.write(frame)
+        return ret, frame
+
+    def release(self):
+        self._capture.release()
+
+class RecordingSource:
+    """
+    Câmara ao vivo com gravação da sessão. Passa pelo connect no lugar do endpoint.
+    """
+    def __init__(self, endpoint : str, writer : FrameArchiveWriter, open_capture):
+        self.endpoint = endpoint
+        self.writer = writer
+        self._open_capture = open_capture
+
+    def __str__(self):
+        return self.endpoint
+
+    def open(self) -> RecordingCapture:
+        return RecordingCapture(self._open_capture(self.endpoint), self.writer)
+
+    def close(self):
+        self.writer.close()
+
+class _ArchiveReader:
+    def __init__(self, file_name : str):
+        index = np.loadtxt(file_name + INDEX_EXTENSION, ndmin=2)
+        # Gravação interrompida antes do primeiro frame. Fica um arquivo já no fim
+        if index.size == 0:
+            index = np.empty((0, 3))
+        self.timestamps = index[:, 0].tolist()
+        self._offsets = index[:, 1].astype(np.int64)
+        self._lengths = index[:, 2].astype(np.int64)
+        self._file = open(file_name, "rb")
+        # Mapeado em memória. Só as páginas dos frames lidos vêm do disco. Um ficheiro vazio não pode ser mapeado
+        self._data = None if len(self.timestamps) == 0 else mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def frame(self, index : int):
+        start = int(self._offsets[index])
+        encoded = np.frombuffer(self._data, dtype=np.uint8, count=int(self._lengths[index]), offset=start)
+        return cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+        self._file.close()
+
+class _VideoReader:
+    # Qualquer vídeo que o OpenCV abra. Os instantes vêm do fps do contentor
+    def __init__(self, file_name : str):
+        self._capture = cv2.VideoCapture(file_name)
+        if not self._capture.isOpened():
+            raise ValueError(f"Couldn't open recording {file_name}")
+        fps = self._capture.get(cv2.CAP_PROP_FPS) or 25
+        count = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.timestamps = [index / fps for index in range(count)]
+        self._position = 0
+
+    def frame(self, index : int):
+        if index < self._position:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self._position = index
+        # Os frames saltados só são descomprimidos se for preciso
+        while self._position < index:
+            self._capture.grab()
+            self._position += 1
+        ret, frame = self._capture.read()
+        self._position += 1
+        return frame if ret else None
+
+    def close(self):
+        self._capture.release()
+
+class ReplayCapture:
+    # O que o connect devolve durante a reprodução. Desligar não perde a posição
+    def __init__(self, replay):
+        self._replay = replay
+
+    def isOpened(self) -> bool:
+        return not self._replay.finished
+
+    def set(self, prop_id, value):
+        return True
+
+    def read(self):
+        return self._replay.read()
+
+    def release(self):
+        pass
+
+class ReplaySource:
+    """
+    Reproduz uma sessão gravada como se fosse a câmara.
+    speed 1 é tempo real, N é N vezes mais rápido e 0 dá cada frame logo que é pedido.
+    Em tempo real um leitor lento perde frames, tal como com a câmara.
+    """
+    def __init__(self, file_name : str, speed : float = 1, loop : bool = False):
+        self.file_name = file_name
+        self.speed = speed
+        self.loop = loop
+        self.finished = False
+        self.frames_read = 0
+        self._reader = _ArchiveReader(file_name) if file_name.endswith(ARCHIVE_EXTENSION) else _VideoReader(file_name)
+        self._timestamps = self._reader.timestamps
+        self._next_index = 0
+        self._clock_start = None
+        self._lock = threading.Lock()
+        if len(self._timestamps) == 0:
+            self.finished = True
+
+    def __str__(self):
+        return f"replay:{self.file_name}"
+
+    def open(self) -> ReplayCapture:
+        return ReplayCapture(self)
+
+    def _restart(self):
+        self._next_index = 0
+        self._clock_start = None
+
+    def _pick_index(self) -> int:
+        if self.speed <= 0:
+            return self._next_index
+
+        now = time.monotonic()
+        if self._clock_start is None:
+            self._clock_start = now
+        target = self._timestamps[0] + (now - self._clock_start) * self.speed
+        # O frame que estaria no ecrã agora. Se ainda não chegou espera por ele como um read da câmara
+        index = max(self._next_index, bisect.bisect_right(self._timestamps, target) - 1)
+        if index < len(self._timestamps) and self._timestamps[index] > target:
+            time.sleep((self._timestamps[index] - target) / self.speed)
+        return index
+
+    def read(self):
+        with self._lock:
+            if self.finished:
+                return False, None
+            index = self._pick_index()
+            if index >= len(self._timestamps):
+                if not self.loop:
+                    self.finished = True
+                    return False, None
+                self._restart()
+                index = self._pick_index()
+
+            self._next_index = index + 1
+            frame = self._reader.frame(index)
+            if frame is None:
+                return False, None
+            self.frames_read += 1
+            return True, frame
+
+    def close(self):
+        self._reader.close()
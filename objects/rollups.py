@@ -0,0 +1,107 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from objects.analytics import MODE_COLUMNS, REPORT_MODES
+
+HOUR_SECONDS = 3600
+
+class RollupProcessor:
+    """
+    Agregados por hora e por dia a partir das leituras da tabela records.
+    Só se grava uma leitura quando o visor muda, por isso o estado de cada leitura dura até à seguinte.
+    O intervalo entre duas leituras é repartido pelas horas que atravessa.
+    A última leitura fica em state para a próxima execução lhe atribuir o tempo que faltou.
+    """
+    def __init__(self, logger : logging.Logger, state : dict = None):
+        self.log = logger
+        self.state = state
+        self.last_timestamp = None if state is None else state["timestamp"]
+
+    def _intervals(self, timestamps, mode_codes, is_burning):
+        # [início, fim) de cada estado, com o modo e se estava a queimar
+        starts, ends = timestamps[:-1], timestamps[1:]
+        codes, burning = mode_codes[:-1], is_burning[:-1]
+        if self.state is not None:
+            starts = np.concatenate(([self.state["timestamp"]], starts))
+            ends = np.concatenate((timestamps[:1], ends))
+            codes = np.concatenate(([self.state["mode_code"]], codes))
+            burning = np.concatenate(([self.state["is_burning"]], burning))
+        return starts, ends, codes, burning
+
+    def process_record_arrays(self, timestamps : np.ndarray, temperatures : np.ndarray,
+                              mode_codes : np.ndarray, is_burning : np.ndarray) -> tuple[list[dict], list[dict]]:
+        if len(timestamps) == 0:
+            return [], []
+
+        timestamps = timestamps.astype(np.int64)
+        temperatures = temperatures.astype(np.int64)
+        mode_codes = mode_codes.astype(np.int64)
+        is_burning = is_burning.astype(bool)
+
+        # Cada intervalo partido em pedaços, um por hora atravessada
+        starts, ends, codes, burning = self._intervals(timestamps, mode_codes, is_burning)
+        first_hours = starts // HOUR_SECONDS
+        pieces = (ends - 1) // HOUR_SECONDS - first_hours + 1
+        interval_ids = np.repeat(np.arange(len(starts)), pieces)
+        piece_hours = first_hours[interval_ids] + np.arange(len(interval_ids)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        seconds = (np.minimum(ends[interval_ids], (piece_hours + 1) * HOUR_SECONDS)
+                   - np.maximum(starts[interval_ids], piece_hours * HOUR_SECONDS))
+
+        sample_hours = timestamps // HOUR_SECONDS
+        hours = np.unique(np.concatenate((piece_hours, sample_hours)))
+        piece_slots = np.searchsorted(hours, piece_hours)
+        sample_slots = np.searchsorted(hours, sample_hours)
+
+        hourly = {"SampleCount": np.bincount(sample_slots, minlength=len(hours)),
+                  "TemperatureSum": np.bincount(sample_slots, weights=temperatures, minlength=len(hours)).astype(np.int64),
+                  "BurningSeconds": np.bincount(piece_slots, weights=seconds * burning[interval_ids], minlength=len(hours)).astype(np.int64)}
+
+        # Modos só contam com a caldeira a queimar. Modos desconhecidos ficam de fora
+        counted = burning[interval_ids] & (codes[interval_ids] >= 0)
+        mode_seconds = np.bincount(piece_slots[counted] * len(REPORT_MODES) + codes[interval_ids][counted],
+                                   weights=seconds[counted], minlength=len(hours) * len(REPORT_MODES))
+        mode_seconds = mode_seconds.reshape(len(hours), len(REPORT_MODES)).astype(np.int64)
+        for index, column in enumerate(MODE_COLUMNS):
+            hourly[column] = mode_seconds[:, index]
+
+        minimums = np.full(len(hours), np.iinfo(np.int64).max)
+        maximums = np.full(len(hours), np.iinfo(np.int64).min)
+        np.minimum.at(minimums, sample_slots, temperatures)
+        np.maximum.at(maximums, sample_slots, temperatures)
+        hourly["MinTemperature"] = minimums
+        hourly["MaxTemperature"] = maximums
+
+        # As horas já vêm ordenadas. Os dias são fatias contíguas
+        hour_starts = [datetime.fromtimestamp(int(hour) * HOUR_SECONDS) for hour in hours]
+        days = np.array([start.toordinal() for start in hour_starts])
+        day_bounds = np.flatnonzero(np.diff(days, prepend=days[0] - 1))
+        daily = {column: np.add.reduceat(values, day_bounds) for column, values in hourly.items()
+                 if column not in ("MinTemperature", "MaxTemperature")}
+        daily["MinTemperature"] = np.minimum.reduceat(minimums, day_bounds)
+        daily["MaxTemperature"] = np.maximum.reduceat(maximums, day_bounds)
+
+        last = len(timestamps) - 1
+        self.state = {"timestamp": int(timestamps[last]),
+                      "mode_code": int(mode_codes[last]),
+                      "is_burning": bool(is_burning[last])}
+        self.last_timestamp = self.state["timestamp"]
+
+        day_starts = [datetime.fromordinal(int(days[bound])) for bound in day_bounds]
+        self.log.info(f"Rolled up {len(timestamps)} records into {len(hours)} hours and {len(day_starts)} days")
+        return self._rows(hour_starts, hourly), self._rows(day_starts, daily)
+
+    @staticmethod
+    def _rows(bucket_starts : list[datetime], columns : dict) -> list[dict]:
+        rows = []
+        for index, bucket_start in enumerate(bucket_starts):
+            row = {"BucketStart": bucket_start}
+            row.update({column: int(values[index]) for column, values in columns.items()})
+            # Horas só com tempo herdado, sem leituras, não têm temperatura
+            if row["SampleCount"] == 0:
+                row["MinTemperature"] = row["MaxTemperature"] = row["AvgTemperature"] = None
+            else:
+                row["AvgTemperature"] = round(row["TemperatureSum"] / row["SampleCount"], 1)
+            rows.append(row)
+        return rows
@@ -0,0 +1,54 @@
+# Primeiro passo do abrandamento. Com wait 0 o mínimo é 0 e multiplicá-lo não saía do sítio
+BACKOFF_STEP = 1
+
+class AdaptiveScheduler:
+    """
+    Intervalo entre amostras conforme o estado da caldeira.
+    Com a caldeira parada ou estável vai abrandando até ao máximo.
+    Quando o modo muda ou a caldeira liga/desliga volta logo ao mínimo.
+    """
+    def __init__(self, min_interval : float, max_interval : float, stable_after : int = 5, backoff : float = 1.5):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.stable_after = stable_after
+        self.backoff = backoff
+        self.interval = min_interval
+        self._stable_count = 0
+        self._previous = None
+
+    def observe(self, result, is_off : bool) -> float:
+        # Leituras inválidas não dizem nada sobre o estado. Mantém o ritmo
+        if result is None or result.is_valid == False:
+            return self.interval
+
+        current = (result.is_burning, result.running_mode, result.temperature)
+        previous = self._previous
+        self._previous = current
+        if previous is None:
+            return self.interval
+
+        if current[0] != previous[0] or current[1] != previous[1]:
+            self._stable_count = 0
+            self.interval = self.min_interval
+        elif current[2] != previous[2]:
+            # A temperatura começou a mexer. Aproxima-se do mínimo sem saltar logo para lá
+            self._stable_count = 0
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self._stable_count += 1
+            if is_off:
+                self.interval = self.max_interval
+            elif self._stable_count >= self.stable_after:
+                self.interval = min(self.max_interval, max(self.interval, BACKOFF_STEP) * self.backoff)
+        return self.interval
+
+def form_scheduler(app_settings : dict, wait_time : float) -> AdaptiveScheduler:
+    # Sem app.adaptive o intervalo fica fixo no wait
+    if "adaptive" not in app_settings:
+        return AdaptiveScheduler(wait_time, wait_time)
+
+    adaptive_settings = app_settings["adaptive"]
+    return AdaptiveScheduler(adaptive_settings.get("min", wait_time),
+                             adaptive_settings.get("max", wait_time),
+                             adaptive_settings.get("stable-after", 5),
+                             adaptive_settings.get("backoff", 1.5))
@@ -0,0 +1,146 @@
+import os
+
+import cv2
+import numpy as np
+
+# Tamanho normalizado de cada célula (largura, altura) e proporção de um dígito do visor
+CELL_SIZE = (20, 32)
+SEGMENT_THICKNESS = 4
+DIGIT_ASPECT = 0.6
+# O process_image inverte a imagem. Os segmentos acesos ficam escuros
+INK_LEVEL = 100
+
+# Segmentos de cada glifo. a topo, b/c direita, d fundo, e/f esquerda, g meio
+GLYPH_SEGMENTS = {
+    "0": "abcdef",
+    "1": "bc",
+    "2": "abdeg",
+    "3": "abcdg",
+    "4": "bcfg",
+    "5": "acdfg",
+    "6": "acdefg",
+    "7": "abc",
+    "8": "abcdefg",
+    "9": "abcdfg",
+    "A": "abcefg"
+}
+
+def render_glyph(segments : str) -> np.ndarray:
+    width, height = CELL_SIZE
+    half = height // 2
+    thickness = SEGMENT_THICKNESS
+    # (y0, y1, x0, x1) de cada segmento
+    boxes = {
+        "a": (0, thickness, thickness, width - thickness),
+        "b": (thickness, half, width - thickness, width),
+        "c": (half, height - thickness, width - thickness, width),
+        "d": (height - thickness, height, thickness, width - thickness),
+        "e": (half, height - thickness, 0, thickness),
+        "f": (thickness, half, 0, thickness),
+        "g": (half - thickness // 2, half + thickness // 2, thickness, width - thickness)
+    }
+    glyph = np.zeros((height, width), dtype=np.float32)
+    for segment in segments:
+        y0, y1, x0, x1 = boxes[segment]
+        glyph[y0:y1, x0:x1] = 1.0
+    return glyph
+
+def find_runs(profile : np.ndarray, max_gap : int = 0) -> list[tuple[int, int]]:
+    # Intervalos [início, fim) onde o perfil tem tinta. Buracos até max_gap são unidos
+    indices = np.flatnonzero(profile)
+    if indices.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indices) > max_gap + 1)
+    starts = np.concatenate(([indices[0]], indices[breaks + 1]))
+    ends = np.concatenate((indices[breaks], [indices[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+class SevenSegmentEngine:
+    """
+    Reconhecedor sem Tesseract para o visor de sete segmentos da Ferlux.
+    Separa a imagem em linhas e células e compara cada célula com os glifos conhecidos.
+    """
+    name = "segments"
+
+    def __init__(self, glyphs_dir : str = None):
+        self.labels, self.templates = self._load_templates(glyphs_dir)
+        self.confidences = []
+
+    def _load_templates(self, glyphs_dir : str):
+        labels = list(GLYPH_SEGMENTS.keys())
+        templates = [render_glyph(segments).ravel() for segments in GLYPH_SEGMENTS.values()]
+
+        # Glifos calibrados a partir de recortes do visor. O nome começa pelo carácter, ex: A_1.png
+        if glyphs_dir is not None:
+            for file_name in sorted(os.listdir(glyphs_dir)):
+                glyph = cv2.imread(os.path.join(glyphs_dir, file_name), cv2.IMREAD_GRAYSCALE)
+                if glyph is None:
+                    continue
+                labels.append(file_name[0:1].upper())
+                templates.append(self._normalise(glyph < INK_LEVEL))
+
+        return labels, np.stack(templates)
+
+    @staticmethod
+    def _normalise(cell : np.ndarray) -> np.ndarray:
+        # O "1" só ocupa o lado direito. Alinha à direita numa caixa com a proporção de um dígito
+        height, width = cell.shape
+        box_width = max(width, int(round(height * DIGIT_ASPECT)))
+        canvas = np.zeros((height, box_width), dtype=np.float32)
+        canvas[:, box_width - width:] = cell
+        return cv2.resize(canvas, CELL_SIZE, interpolation=cv2.INTER_AREA).ravel()
+
+    def _read_line(self, line : np.ndarray) -> tuple[str, list[float]]:
+        line_height = line.shape[0]
+        cells = []
+        for x0, x1 in find_runs(line.any(axis=0), max(1, int(line_height * 0.08))):
+            cell = line[:, x0:x1]
+            rows = np.flatnonzero(cell.any(axis=1))
+            # Pontos e ruído não têm a altura de um dígito
+            if rows[-1] - rows[0] + 1 < line_height * 0.5:
+                continue
+            cells.append((x0, x1, cell[rows[0]:rows[-1] + 1]))
+
+        if not cells:
+            return "", []
+
+        vectors = np.stack([self._normalise(cell) for _, _, cell in cells])
+        distances = np.abs(vectors[:, None, :] - self.templates[None, :, :]).mean(axis=2)
+        best = distances.argmin(axis=1)
+        scores = 1.0 - distances[np.arange(len(cells)), best]
+
+        text = ""
+        confidences = []
+        space_width = line_height * DIGIT_ASPECT
+        for index, (x0, _, _) in enumerate(cells):
+            if index > 0 and x0 - cells[index - 1][1] > space_width:
+                text += " "
+                confidences.append(1.0)
+            text += self.labels[best[index]]
+            confidences.append(float(scores[index]))
+        return text, confidences
+
+    @property
+    def text_confidence(self) -> float:
+        if len(self.confidences) == 0:
+            return 0.0
+        return sum(self.confidences) / len(self.confidences)
+
+    def recognize(self, image, psm : int = None) -> str:
+        ink = image < INK_LEVEL
+        row_runs = find_runs(ink.any(axis=1), 1)
+        tallest = max((y1 - y0 for y0, y1 in row_runs), default=0)
+
+        lines = []
+        self.confidences = []
+        for y0, y1 in row_runs:
+            if y1 - y0 < tallest * 0.3:
+                continue
+            text, confidences = self._read_line(ink[y0:y1])
+            if text:
+                lines.append(text)
+                self.confidences.extend(confidences)
+        return "\n".join(lines)
+
+    def close(self):
+        pass
@@ -0,0 +1,97 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Subcomandos medidos por defeito e as bibliotecas pesadas que interessa ver quem carrega
+STARTUP_COMMANDS = ("run", "report", "reference", "rollup", "archive", "migrate", "bench")
+HEAVY_MODULES = ("cv2", "numpy", "pytesseract", "tesserocr", "sqlalchemy")
+# Crescimento do tempo de arranque tolerado antes de o --compare falhar
+WALL_TOLERANCE = 0.25
+# Os pacotes da aplicação aparecem em todos os subcomandos. Interessa o que eles puxam
+OWN_PACKAGES = ("commands", "objects", "persistence")
+
+def _parse_importtime(stderr : str) -> tuple[int, dict]:
+    """
+    Linhas "import time: self | cumulative | nome", com o nome indentado pela profundidade.
+    Devolve o total dos imports de topo e o tempo acumulado de cada pacote de terceiros, venha de onde vier.
+    """
+    total = 0
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            total += int(cumulative)
+        name = name.strip()
+        if "." not in name and name not in OWN_PACKAGES:
+            packages[name] = int(cumulative)
+    return total, packages
+
+def measure_command(package_dir : str, command : str) -> dict:
+    """
+    Arranca um interpretador novo que só importa o que o subcomando importa, com -X importtime.
+    O próprio processo filho diz o pico de memória no fim.
+    """
+    code = ("import argparse, importlib, resource, sys; "
+            f"importlib.import_module('commands.{command}'); "
+            "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, ' '.join(sorted(sys.modules)))")
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=package_dir,
+                             capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {command} failed: {process.stderr.strip().splitlines()[-1]}")
+
+    rss_kb, modules = process.stdout.split(" ", 1)
+    modules = set(modules.split())
+    import_us, packages = _parse_importtime(process.stderr)
+    return {"wall_ms": wall * 1000,
+            "import_ms": import_us / 1000,
+            "rss_mb": int(rss_kb) / 1024,
+            "heavy_modules": [module for module in HEAVY_MODULES if module in modules],
+            "slowest": {name: round(us / 1000, 1) for name, us in sorted(packages.items(), key=lambda item: -item[1])[:5]}}
+
+def run_startup_bench(package_dir : str, commands : list[str], logger, repeat : int = 5) -> dict:
+    # Mediana de várias execuções. A primeira aquece a cache de páginas como faria o cron
+    results = []
+    for command in commands:
+        measure_command(package_dir, command)
+        runs = [measure_command(package_dir, command) for _ in range(repeat)]
+        result = {"command": command,
+                  "wall_ms": round(statistics.median(run["wall_ms"] for run in runs), 1),
+                  "import_ms": round(statistics.median(run["import_ms"] for run in runs), 1),
+                  "rss_mb": round(max(run["rss_mb"] for run in runs), 1),
+                  "heavy_modules": runs[0]["heavy_modules"],
+                  "slowest": runs[0]["slowest"]}
+        logger.info(f"{command}: {result['wall_ms']} ms to start, {result['import_ms']} ms importing, "
+                    f"{result['rss_mb']} MB, loads {result['heavy_modules']}")
+        results.append(result)
+
+    return {"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "repeat": repeat,
+            "results": results}
+
+def compare_startup(previous : dict, current : dict, logger) -> bool:
+    # Falso se um subcomando passou a carregar uma biblioteca pesada ou ficou bem mais lento a arrancar
+    regressed = False
+    previous_commands = {result["command"]: result for result in previous["results"]}
+    for result in current["results"]:
+        before = previous_commands.get(result["command"])
+        if before is None:
+            continue
+        logger.info(f"{result['command']}: {before['wall_ms']} -> {result['wall_ms']} ms, {before['rss_mb']} -> {result['rss_mb']} MB")
+        added = [module for module in result["heavy_modules"] if module not in before["heavy_modules"]]
+        if added:
+            logger.error(f"{result['command']} now imports {added}")
+            regressed = True
+        if result["wall_ms"] > before["wall_ms"] * (1 + WALL_TOLERANCE):
+            logger.error(f"{result['command']} startup went from {before['wall_ms']} to {result['wall_ms']} ms")
+            regressed = True
+    return not regressed
+
+def package_dir() -> str:
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
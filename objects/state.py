@@ -0,0 +1,125 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Leituras recentes guardadas por caldeira
+HISTORY_SIZE = 60
+CONTENT_TYPE = "application/json"
+
+def form_reading(result, frame_age : float = None) -> dict:
+    return {"marked_time": result.marked_time.strftime("%Y-%m-%dT%H:%M"),
+            "temperature": result.temperature,
+            "running_mode": result.running_mode,
+            "is_burning": result.is_burning,
+            "observed_at": round(time.time(), 3),
+            "frame_age": None if frame_age is None else round(frame_age, 3)}
+
+class LatestState:
+    """
+    Última leitura válida de cada caldeira e as mudanças mais recentes, em memória.
+    O ciclo de captura só guarda um dicionário. O JSON é feito no pedido e reaproveitado até haver leitura nova.
+    A versão muda com cada leitura e serve de ETag.
+    """
+    def __init__(self, history_size : int = HISTORY_SIZE):
+        self.history_size = history_size
+        self.version = 0
+        self._boilers = {}
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def update(self, result, frame_age : float = None, is_change : bool = True):
+        reading = form_reading(result, frame_age)
+        with self._lock:
+            boiler = self._boilers.get(result.boiler_id)
+            if boiler is None:
+                boiler = {"latest": None, "history": deque(maxlen=self.history_size)}
+                self._boilers[result.boiler_id] = boiler
+            boiler["latest"] = reading
+            # Como na tabela records, o histórico só leva as leituras que mudaram
+            if is_change:
+                boiler["history"].append(reading)
+            self.version += 1
+
+    def _document(self, boiler_id : int = None):
+        if boiler_id is None:
+            return {"boilers": [{"boiler": key, **boiler["latest"]} for key, boiler in sorted(self._boilers.items())]}
+        boiler = self._boilers.get(boiler_id)
+        if boiler is None:
+            return None
+        return {"boiler": boiler_id, **boiler["latest"], "history": list(boiler["history"])}
+
+    def render(self, boiler_id : int = None) -> tuple[str, bytes]:
+        # (ETag, corpo). Corpo None se a caldeira ainda não tem leituras
+        with self._lock:
+            etag = f'"{self.version}"'
+            cached = self._bodies.get(boiler_id)
+            if cached is not None and cached[0] == etag:
+                return cached
+            document = self._document(boiler_id)
+            body = None if document is None else json.dumps(document).encode("utf-8")
+            self._bodies[boiler_id] = (etag, body)
+            return etag, body
+
+latest_state = LatestState()
+
+class _StateHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # /state para todas as caldeiras, /state/<id> para uma com o histórico
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[0] != "state" or len(parts) > 2 or (len(parts) == 2 and not parts[1].isdigit()):
+            self.send_error(404)
+            return
+        etag, body = latest_state.render(int(parts[1]) if len(parts) == 2 else None)
+        if body is None:
+            self.send_error(404)
+            return
+        if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StateServer:
+    """
+    Expõe o estado atual das caldeiras num /state local, sem passar pela base de dados.
+    """
+    def __init__(self, api_settings : dict, logger : logging.Logger):
+        self.log = logger
+        self.port = api_settings.get("port", 8080)
+        self.host = api_settings.get("host", "127.0.0.1")
+        latest_state.history_size = api_settings.get("history", HISTORY_SIZE)
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _StateHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="state-http", daemon=True)
+        self._thread.start()
+        self.log.info(f"Boiler state available at http://{self.host}:{self.port}/state")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+def form_state_server(app_settings : dict, logger : logging.Logger):
+    if "api" not in app_settings:
+        return None
+    server = StateServer(app_settings["api"], logger)
+    server.start()
+    return server
@@ -0,0 +1,148 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from objects.boiler import BoilerRecorder
+from objects.camera import FrameSource, form_camera_source
+from objects.metrics import time_stage
+from objects.ocr import FrameChangeGate, form_display_regions, form_preprocessor, init_ocr_process, prepare_image, recognize_in_process
+from objects.scheduler import form_scheduler
+from objects.voting import vote_text
+
+class CameraLogger(logging.LoggerAdapter):
+    # Várias câmaras no mesmo log. Cada linha diz de que câmara é
+    def process(self, msg, kwargs):
+        return f"[{self.extra['camera']}] {msg}", kwargs
+
+class CameraWorker:
+    """
+    Uma thread por câmara. Vai buscar o frame e prepara a imagem, o OCR vai para o pool partilhado.
+    Cada câmara tem o seu próprio estado de caldeira.
+    """
+    def __init__(self, camera_settings : dict, ocr_settings : dict, app_settings : dict, pool : ProcessPoolExecutor,
+                 logger : logging.Logger, is_dry_run : bool, record_sink):
+        self.boiler_id = camera_settings.get("boiler", 1)
+        self.camera_id = camera_settings.get("id", f"boiler-{self.boiler_id}")
+        self.log = CameraLogger(logger, {"camera": self.camera_id})
+        self.source = form_camera_source(camera_settings)
+        self.wait_time = camera_settings.get("wait", app_settings.get("wait", 0))
+        self.scheduler = form_scheduler(app_settings, self.wait_time)
+        self._stop_event = threading.Event()
+        self.frame_source = FrameSource(self.source, camera_settings, self.log, self._stop_event)
+
+        # Cada câmara vê o visor num sítio diferente. Sem ROI próprio usa o geral
+        self.roi_settings = camera_settings.get("roi", ocr_settings.get("roi"))
+        self.regions = form_display_regions(self.roi_settings, ocr_settings)
+        self.scale = ocr_settings.get("preprocess", {}).get("scale", 1)
+        self.preprocessor = form_preprocessor(ocr_settings)
+        change_threshold = camera_settings.get("change-threshold", ocr_settings.get("change-threshold"))
+        self.change_gate = None if change_threshold is None else FrameChangeGate(change_threshold)
+
+        self.recorder = BoilerRecorder(self.log, is_dry_run, record_sink, self.boiler_id)
+        self._pool = pool
+        self._thread = None
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self.frame_source.start()
+        self._thread = threading.Thread(target=self._run, name=f"camera-{self.camera_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def join(self, timeout : float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.frame_source.stop()
+
+    def _extract_text(self, frames : list) -> str:
+        # Sem janelas de debug. O imshow não funciona fora da thread principal
+        images = [prepare_image(frame, False, self.regions, self.preprocessor) for frame in frames]
+        if self.change_gate is not None and self.change_gate.is_unchanged(images[0]):
+            return self.change_gate.cached_text
+
+        # Os frames do burst vão todos ao pool ao mesmo tempo. O tempo do OCR conta aqui, os processos têm registo próprio
+        with time_stage("ocr"):
+            futures = [self._pool.submit(recognize_in_process, image, self.roi_settings, self.scale) for image in images]
+            candidates = [future.result() for future in futures]
+        text = vote_text(candidates)
+        if self.change_gate is not None:
+            self.change_gate.update(images[0], text)
+        return text
+
+    def _run(self):
+        self.log.info(f"Video feed started for boiler {self.boiler_id}. Analyzing frames.")
+        while not self._stop_event.is_set():
+            frames = self.frame_source.read_burst()
+            if not frames:
+                if self.frame_source.finished:
+                    self.log.info("Replay finished")
+                    return
+                if not self.frame_source.is_persistent:
+                    self.log.critical("Couldn't read from video feed. Giving up.")
+                    return
+                self.log.warning("No recent frame available. Waiting for the video feed.")
+                self._stop_event.wait(max(self.wait_time, 1))
+                continue
+            captured_at = self.frame_source.capture_time()
+
+            try:
+                detected_text = self._extract_text(frames)
+            except CancelledError:
+                return
+            except (BrokenProcessPool, RuntimeError) as e:
+                # Pool já fechado no stop ou um processo de OCR morreu. Sem pool esta câmara não tem como continuar
+                if not self._stop_event.is_set():
+                    self.log.critical(f"OCR pool unavailable. Stopping camera: {e}")
+                return
+
+            self.log.debug(f"Detected Text: {detected_text}")
+            try:
+                self.recorder.handle(detected_text, frame_age=time.monotonic() - captured_at)
+            except Exception as e:
+                self.log.warning(f"Failed while forming the log. Retrying in the next cycle {e}. OCR is {detected_text}")
+
+            self._stop_event.wait(self.scheduler.observe(self.recorder.last_result, self.recorder.stop_recording))
+
+class CaptureSupervisor:
+    """
+    Corre todas as câmaras das definições num só processo, com um pool de OCR do tamanho dos cores.
+    """
+    def __init__(self, app_settings : dict, logger : logging.Logger, is_dry_run : bool, record_sink):
+        self.log = logger
+        ocr_settings = app_settings["ocr"]
+        pool_size = ocr_settings.get("workers", os.cpu_count())
+
+        # Os processos só nascem no primeiro submit, com o grabber, o spool e o servidor HTTP já a correr.
+        # Um fork com threads pode herdar locks presos. O forkserver arranca-os de um processo limpo
+        self._pool = ProcessPoolExecutor(max_workers=pool_size, mp_context=multiprocessing.get_context("forkserver"),
+                                         initializer=init_ocr_process, initargs=(ocr_settings,))
+        self.workers = [CameraWorker(camera_settings, ocr_settings, app_settings["app"], self._pool, logger, is_dry_run, record_sink)
+                        for camera_settings in app_settings["cameras"]]
+        self.log.info(f"Supervising {len(self.workers)} cameras with {pool_size} OCR processes")
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def wait(self, on_tick=None, interval : float = 1):
+        # Volta quando todas as câmaras desistirem. on_tick corre na thread principal entretanto
+        while any(worker.is_alive() for worker in self.workers):
+            if on_tick is not None:
+                on_tick()
+            time.sleep(interval)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for worker in self.workers:
+            worker.join()
+        self.log.info("All cameras stopped")
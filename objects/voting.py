@@ -0,0 +1,65 @@
+import logging
+from collections import defaultdict
+
+from objects.boiler import form_boiler_data
+
+# As leituras falhadas de um burst são esperadas. Não vão para o log principal
+_quiet_logger = logging.getLogger("boiler.voting")
+_quiet_logger.addHandler(logging.NullHandler())
+_quiet_logger.propagate = False
+
+def _parse_candidate(text : str):
+    try:
+        return form_boiler_data(text, _quiet_logger)
+    except Exception:
+        return None
+
+def _weighted_majority(values : list, weights : list[float]):
+    totals = defaultdict(float)
+    for value, weight in zip(values, weights):
+        totals[value] += weight
+    return max(totals, key=totals.get)
+
+def _weighted_median(values : list[int], weights : list[float]) -> int:
+    ordered = sorted(zip(values, weights))
+    half = sum(weights) / 2
+    accumulated = 0.0
+    for value, weight in ordered:
+        accumulated += weight
+        if accumulated >= half:
+            return value
+    return ordered[-1][0]
+
+def vote_text(candidates : list[tuple[str, float]]) -> str:
+    """
+    Junta as leituras de vários frames do mesmo visor numa só.
+    Só contam as leituras válidas. Estado e modo vão a votos, a temperatura é a mediana, tudo pesado pela confiança.
+    Se nenhuma for válida devolve a de maior confiança para o BoilerData se queixar como antes.
+    """
+    if not candidates:
+        return ""
+
+    valid = []
+    for text, confidence in candidates:
+        result = _parse_candidate(text)
+        if result is not None and result.is_valid:
+            # Confiança zero não pode anular uma leitura válida
+            valid.append((text, result, max(confidence, 0.01)))
+
+    if not valid:
+        return max(candidates, key=lambda candidate: candidate[1])[0]
+    if len(valid) == 1:
+        return valid[0][0]
+
+    weights = [weight for _, _, weight in valid]
+    is_burning = _weighted_majority([result.is_burning for _, result, _ in valid], weights)
+    agreeing = [(text, result, weight) for text, result, weight in valid if result.is_burning == is_burning]
+    weights = [weight for _, _, weight in agreeing]
+
+    marked_time = _weighted_majority([text.splitlines()[0].strip() for text, _, _ in agreeing], weights)
+    temperature = _weighted_median([result.temperature for _, result, _ in agreeing], weights)
+    if not is_burning:
+        return f"{marked_time}\n{temperature}"
+
+    running_mode = _weighted_majority([result.running_mode for _, result, _ in agreeing], weights)
+    return f"{marked_time}\n{running_mode} {temperature}"
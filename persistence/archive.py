@@ -0,0 +1,115 @@
+import logging
+import os
+import re
+from datetime import datetime
+
+from objects.analytics import MODE_CODES
+
+# O NumPy só é importado nos métodos que leem ou escrevem ficheiros. A base de dados importa este módulo
+ARCHIVE_FILE = re.compile(r"^records-(\d{4})-(\d{2})\.npz$")
+
+def month_start(moment : datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+def add_months(moment : datetime, months : int) -> datetime:
+    month_index = moment.year * 12 + moment.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+class RecordArchive:
+    """
+    Meses antigos da tabela records em ficheiros colunares comprimidos, um por mês.
+    Os instantes são guardados como diferenças, temperatura e modo em inteiros pequenos.
+    Lê de volta no mesmo formato da base de dados para os reports não notarem a diferença.
+    """
+    def __init__(self, directory : str, logger : logging.Logger):
+        self.directory = directory
+        self.log = logger
+        os.makedirs(directory, exist_ok=True)
+
+    def _file_name(self, month : datetime) -> str:
+        return os.path.join(self.directory, f"records-{month.year:04d}-{month.month:02d}.npz")
+
+    def months(self) -> list[datetime]:
+        months = []
+        for file_name in os.listdir(self.directory):
+            match = ARCHIVE_FILE.match(file_name)
+            if match:
+                months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months)
+
+    @property
+    def end_timestamp(self) -> int:
+        # Tudo antes disto está no arquivo. A base de dados só é lida daqui para a frente
+        months = self.months()
+        return 0 if len(months) == 0 else int(add_months(months[-1], 1).timestamp())
+
+    def write_month(self, month : datetime, columns : dict) -> int:
+        import numpy as np
+
+        order = np.argsort(columns["timestamps"], kind="stable")
+        timestamps = np.asarray(columns["timestamps"], dtype=np.int64)[order]
+        # O RunningMode tem um carácter. Guarda-se o código desse carácter num byte, 0 é sem modo
+        mode_codes = np.array([ord(columns["running_modes"][index] or "\0") for index in order], dtype=np.uint8)
+        temperatures = np.asarray(columns["temperatures"], dtype=np.int16)[order]
+        # O visor mostra dois dígitos. Só leituras fora do int8 obrigam a guardar o mês em int16
+        if len(temperatures) == 0 or (temperatures.min() >= -128 and temperatures.max() <= 127):
+            temperatures = temperatures.astype(np.int8)
+
+        file_name = self._file_name(month)
+        temporary_file = f"{file_name}.tmp.npz"
+        np.savez_compressed(temporary_file,
+                            first_timestamp=timestamps[:1],
+                            timestamp_deltas=np.diff(timestamps).astype(np.int32),
+                            temperatures=temperatures,
+                            mode_codes=mode_codes,
+                            is_burning=np.asarray(columns["is_burning"], dtype=bool)[order],
+                            boiler_ids=np.asarray(columns["boiler_ids"], dtype=np.int16)[order],
+                            marked_times=np.array([columns["marked_times"][index] or "" for index in order]))
+        # Só fica com o nome final quando está completo
+        os.replace(temporary_file, file_name)
+        self.log.info(f"Archived {len(timestamps)} records of {month:%Y-%m} to {file_name}")
+        return len(timestamps)
+
+    def _load(self, month : datetime) -> dict:
+        import numpy as np
+
+        with np.load(self._file_name(month)) as archive:
+            first = archive["first_timestamp"]
+            timestamps = np.concatenate((first, first[0] + np.cumsum(archive["timestamp_deltas"], dtype=np.int64))) if len(first) else first
+            return {"timestamps": timestamps,
+                    "temperatures": archive["temperatures"].astype(np.int16),
+                    "archive_modes": archive["mode_codes"],
+                    "is_burning": archive["is_burning"],
+                    "boiler_ids": archive["boiler_ids"],
+                    "marked_times": archive["marked_times"]}
+
+    def _select(self, start_timestamp : int, end_timestamp : int, boiler_id : int):
+        # Meses que tocam em [início, fim), filtrados à caldeira
+        for month in self.months():
+            if int(add_months(month, 1).timestamp()) <= start_timestamp or int(month.timestamp()) >= end_timestamp:
+                continue
+            columns = self._load(month)
+            mask = ((columns["boiler_ids"] == boiler_id) & (columns["timestamps"] >= start_timestamp)
+                    & (columns["timestamps"] < end_timestamp))
+            yield {name: values[mask] for name, values in columns.items()}
+
+    def read_arrays(self, start_timestamp : int, end_timestamp : int, boiler_id : int = 1) -> list[dict]:
+        # Mesmas colunas do get_record_arrays, um bloco por mês
+        import numpy as np
+
+        report_codes = np.array([MODE_CODES.get(chr(code), -1) for code in range(256)], dtype=np.int64)
+        blocks = []
+        for columns in self._select(start_timestamp, end_timestamp, boiler_id):
+            blocks.append({"timestamps": columns["timestamps"],
+                           "temperatures": columns["temperatures"],
+                           "mode_codes": report_codes[columns["archive_modes"]],
+                           "is_burning": columns["is_burning"]})
+        return blocks
+
+    def iter_records(self, start_timestamp : int, end_timestamp : int, boiler_id : int = 1):
+        # Linhas como as do get_report_records_after: instante, temperatura, hora do visor, modo, a queimar
+        for columns in self._select(start_timestamp, end_timestamp, boiler_id):
+            for timestamp, temperature, marked_time, mode_code, is_burning in zip(
+                    columns["timestamps"].tolist(), columns["temperatures"].tolist(), columns["marked_times"].tolist(),
+                    columns["archive_modes"].tolist(), columns["is_burning"].tolist()):
+                yield (timestamp, temperature, marked_time or None, chr(mode_code) if mode_code else None, is_burning)
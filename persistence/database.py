@@ -1,18 +1,99 @@
-from sqlalchemy import DateTime, Numeric, Time, create_engine, MetaData, Table, Column, Integer, SmallInteger , String, Boolean, func, insert, select, null
-from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy import DateTime, Numeric, Time, Text, bindparam, create_engine, delete, event, inspect, text, update, MetaData, Table, Column, Integer, SmallInteger , String, Boolean, func, insert, select, null
+from sqlalchemy.dialects.mysql import insert as upsert
+from sqlalchemy.exc import DBAPIError, IntegrityError, SQLAlchemyError
 
+import json
 import logging
+import threading
+import time
 from datetime import datetime
 
-from objects.analytics import ReportData
+from objects.analytics import MODE_CODES, MODE_COLUMNS, ReportData
+from objects.metrics import DB_DISCONNECTS, DB_ERRORS, DB_POOL_CHECKED_OUT, DB_RETRIES
+from persistence.archive import RecordArchive, add_months, month_start
+
+# Ligações paradas mais tempo que isto são renovadas antes do wait_timeout do MariaDB (8 h por defeito)
+POOL_RECYCLE = 3600
+
+def form_record_row(record_object) -> dict:
+    return {"SystemTimestamp": int(datetime.now().timestamp()),
+            "Temperature": record_object.temperature,
+            "MarkedTime": record_object.marked_time.strftime("%Y-%m-%dT%H:%MZ"),
+            "RunningMode": record_object.running_mode,
+            "IsBurning": record_object.is_burning,
+            "BoilerID": record_object.boiler_id}
+
+def form_database_engine(db_url : str, pool_size : int = 2, max_overflow : int = 4, pool_recycle : int = POOL_RECYCLE):
+    # O pre-ping testa a ligação antes de a entregar. Uma ligação morta pelo restart do MariaDB é trocada sem erro
+    engine = create_engine(db_url, pool_pre_ping=True, pool_recycle=pool_recycle,
+                           pool_size=pool_size, max_overflow=max_overflow)
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.inc(-1)
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        DB_DISCONNECTS.inc()
+
+    return engine
+
+def form_partition_name(month : datetime) -> str:
+    return f"p{month.year:04d}{month.month:02d}"
+
+def form_partition_clause(month : datetime) -> str:
+    # Cada partição guarda os records de um mês, até ao início do seguinte
+    return f"PARTITION {form_partition_name(month)} VALUES LESS THAN ({int(add_months(month, 1).timestamp())})"
+
+def form_checkpoint_name(boiler_id : int, name : str = "report") -> str:
+    # A caldeira 1 mantém o nome antigo para os checkpoints já gravados continuarem válidos
+    return name if boiler_id == 1 else f"{name}-{boiler_id}"
+
+def form_rollup_table(name : str, metadata : MetaData) -> Table:
+    # Uma linha por caldeira e por hora ou dia. A soma e a contagem deixam juntar execuções sem reler os records
+    return Table(
+        name, metadata,
+        Column("BucketStart", DateTime, primary_key=True),
+        Column("BoilerID", SmallInteger, primary_key=True),
+        Column("SampleCount", Integer, nullable=False),
+        Column("TemperatureSum", Integer, nullable=False),
+        Column("MinTemperature", SmallInteger, nullable=True),
+        Column("MaxTemperature", SmallInteger, nullable=True),
+        Column("AvgTemperature", Numeric(3,1), nullable=True),
+        Column("BurningSeconds", Integer, nullable=False),
+        *[Column(column, Integer, nullable=False) for column in MODE_COLUMNS]
+    )
 
 class MariaDBHandler:
-    def __init__(self, db_url: str, log : logging.Logger):
+    def __init__(self, db_url: str, log : logging.Logger, batch_size : int = 1, flush_interval : float = 0,
+                 pool_size : int = 2, pool_recycle : int = POOL_RECYCLE, retries : int = 3, retry_delay : float = 1,
+                 archive : RecordArchive = None):
         self.log = log
-        self.engine = create_engine(db_url)
+        # Meses já exportados da tabela records. As leituras juntam-nos à frente do que está na base de dados
+        self.archive = archive
+        # Registos ficam em memória até serem N ou passarem T segundos. Depois vão todos numa transação. T a 0 só conta N
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending_records = []
+        self._last_flush = time.monotonic()
+        self._closed = False
+        # Protege os registos em memória. As ligações vêm do pool, uma por operação
+        self._lock = threading.RLock()
+        # Quantas vezes uma operação é repetida quando a ligação cai a meio
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.retried = 0
+        self.engine = form_database_engine(db_url, pool_size, pool_size * 2, pool_recycle)
         self.log.info("Connecting to database...")
-        self.connection = self.engine.connect()
+        with self.engine.connect():
+            pass
         self.log.info(f"Connected to database {self.engine.url}")
+        # Partições só no MariaDB. Noutras bases de dados os meses arquivados são apagados com DELETE
+        self.supports_partitions = self.engine.dialect.name in ("mysql", "mariadb")
 
         self.metadata = MetaData()
         self.records = Table(
@@ -21,7 +102,8 @@ class MariaDBHandler:
             Column("Temperature", SmallInteger, nullable=False),
             Column("MarkedTime", String(20), nullable=True),
             Column("RunningMode", String(1), nullable=True),
-            Column("IsBurning", Boolean, nullable=False)
+            Column("IsBurning", Boolean, nullable=False),
+            Column("BoilerID", SmallInteger, primary_key=True, default=1)
         )
         self.report = Table(
             "report", self.metadata,
@@ -36,7 +118,8 @@ class MariaDBHandler:
             Column("Mode5", Time, nullable=False),
             Column("ModeA", Time, nullable=False),
             Column("TotalDuration", Time, nullable=False),
-            Column("HasStandby", Boolean, nullable=False)
+            Column("HasStandby", Boolean, nullable=False),
+            Column("BoilerID", SmallInteger, nullable=False, default=1)
         )
         self.consumption = Table(
             "consumption", self.metadata,
@@ -45,13 +128,83 @@ class MariaDBHandler:
             Column("Quantity", Numeric(2,1), nullable=False),
             Column("MaxRoomTemperature", Numeric(3,1), nullable=False),
             Column("MaxBoilerTemperature", Numeric(3,1), nullable=False)
-        )        
-    def get_reporting_last_end_time(self) -> datetime:
+        )
+        # Onde o último report parou e o ciclo que ficou a meio
+        self.report_checkpoint = Table(
+            "report_checkpoint", self.metadata,
+            Column("Name", String(20), primary_key=True),
+            Column("LastTimestamp", Integer, nullable=False),
+            Column("State", Text, nullable=True)
+        )
+        self.rollup_hourly = form_rollup_table("rollup_hourly", self.metadata)
+        self.rollup_daily = form_rollup_table("rollup_daily", self.metadata)
+        self.metadata.create_all(self.engine, tables=[self.report_checkpoint, self.rollup_hourly, self.rollup_daily])
+        self._check_schema()
+
+        # Construídos uma vez. O SQLAlchemy guarda a compilação em cache e cada insert só leva os parâmetros
+        self._insert_records = insert(self.records)
+        self._insert_report = insert(self.report)
+        self._insert_consumption = insert(self.consumption)
+
+    def _execute(self, work):
+        # Corre work(connection) numa transação. Se a ligação cair a meio tenta outra vez com uma nova
+        for attempt in range(self.retries + 1):
+            try:
+                with self.engine.begin() as connection:
+                    return work(connection)
+            except DBAPIError as e:
+                if not e.connection_invalidated or attempt == self.retries:
+                    raise
+                self.retried += 1
+                DB_RETRIES.inc()
+                self.log.warning(f"Database connection lost. Retrying ({attempt + 1}/{self.retries}): {e.orig}")
+                time.sleep(self.retry_delay * (attempt + 1))
+
+    def pool_stats(self) -> dict:
+        pool = self.engine.pool
+        return {"size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "retried": self.retried,
+                "status": pool.status()}
+
+    def get_schema_changes(self) -> list[str]:
+        # ALTERs que faltam a bases de dados anteriores às várias caldeiras. Um por tabela, para não ficar a meio
+        inspector = inspect(self.engine)
+        changes = []
+        for table in (self.records, self.report):
+            if not inspector.has_table(table.name):
+                continue
+            clauses = []
+            if "BoilerID" not in {column["name"] for column in inspector.get_columns(table.name)}:
+                clauses.append("ADD COLUMN BoilerID SMALLINT NOT NULL DEFAULT 1")
+            # Também apanha uma migração antiga que adicionou a coluna e falhou na chave
+            if table is self.records and "BoilerID" not in inspector.get_pk_constraint(table.name)["constrained_columns"]:
+                clauses.append("DROP PRIMARY KEY, ADD PRIMARY KEY (SystemTimestamp, BoilerID)")
+            if len(clauses) > 0:
+                changes.append(f"ALTER TABLE {table.name} {', '.join(clauses)}")
+        return changes
+
+    def _check_schema(self):
+        # Só avisa. Qualquer subcomando cria o handler, mudar o esquema é só com o migrate
+        changes = self.get_schema_changes()
+        if len(changes) > 0:
+            self.log.critical(f"Database schema is missing the boiler columns. Run the migrate subcommand ({len(changes)} changes pending)")
+
+    def migrate_schema(self) -> int:
+        # Tudo o que lá está passa a ser da caldeira 1
+        changes = self.get_schema_changes()
+        for statement in changes:
+            self.log.warning(f"Migrating: {statement}")
+            with self.engine.begin() as connection:
+                connection.execute(text(statement))
+        return len(changes)
+
+    def get_reporting_last_end_time(self, boiler_id : int = 1) -> datetime:
         try:
-            stmt = select(func.max(self.report.c.EndTime))
+            stmt = select(func.max(self.report.c.EndTime)).where(self.report.c.BoilerID == boiler_id)
 
-            result = self.connection.execute(stmt)
-            latest_end_time = result.scalar()
+            latest_end_time = self._execute(lambda connection: connection.execute(stmt).scalar())
             
             if latest_end_time is None:
                 self.log.info("No records found in report table, returning default date")
@@ -69,25 +222,19 @@ class MariaDBHandler:
                 .outerjoin(self.consumption, self.report.c.ID == self.consumption.c.ReportID)
                 .where(self.consumption.c.ReportID.is_(None))
             )
-            result = self.connection.execute(stmt)
-            all_results = result.fetchall()
-            return all_results
+            return self._execute(lambda connection: connection.execute(stmt).fetchall())
         except SQLAlchemyError as e:
             self.log.error(f"Error fetching latest missing results: {e}")
             return None
     def insert_consumption_record(self, data : dict):
-        stmt = insert(self.consumption).values(
-                                        ID=data["id"],            
-                                        ReportID=data["report_id"],
-                                        Quantity=data["quantity"],
-                                        MaxRoomTemperature=data["max_room_temperature"],
-                                        MaxBoilerTemperature=data["max_boiler_temperature"]
-                                        )
-        stmt.compile(self.engine, compile_kwargs={"literal_binds": True})
+        row = {"ID": data["id"],
+               "ReportID": data["report_id"],
+               "Quantity": data["quantity"],
+               "MaxRoomTemperature": data["max_room_temperature"],
+               "MaxBoilerTemperature": data["max_boiler_temperature"]}
         try:
             
-            result = self.connection.execute(stmt)
-            self.connection.commit()
+            result = self._execute(lambda connection: connection.execute(self._insert_consumption, row))
             self.log.info(f"Inserted consumption record with ID {result.inserted_primary_key[0]}")
                 
             return result.inserted_primary_key[0]
@@ -100,80 +247,414 @@ class MariaDBHandler:
         except Exception as e:
             self.log.critical(f"Unexpected Error: {e}")
             return None
-    def get_report_records_after(self):
+    def get_report_checkpoint(self, boiler_id : int = 1, name : str = "report") -> tuple[int, dict]:
         try:
-            timestamp = self.get_reporting_last_end_time()
-            timestamp_int = int(timestamp.timestamp())
-            stmt = select(self.records).where(self.records.c.SystemTimestamp > timestamp_int
-                                              ).order_by(self.records.c.SystemTimestamp.asc())
+            stmt = select(self.report_checkpoint.c.LastTimestamp, self.report_checkpoint.c.State
+                          ).where(self.report_checkpoint.c.Name == form_checkpoint_name(boiler_id, name))
+            row = self._execute(lambda connection: connection.execute(stmt).first())
+            if row is None:
+                self.log.info(f"No {name} checkpoint found. Starting from the beginning")
+                return None, None
+            return row[0], None if row[1] is None else json.loads(row[1])
+        except SQLAlchemyError as e:
+            self.log.error(f"Error fetching {name} checkpoint: {e}")
+            return None, None
+
+    def _checkpoint_upsert(self, name : str, last_timestamp : int, state : dict):
+        state_json = None if state is None else json.dumps(state)
+        stmt = upsert(self.report_checkpoint).values(Name=name, LastTimestamp=last_timestamp, State=state_json)
+        return stmt.on_duplicate_key_update(LastTimestamp=stmt.inserted.LastTimestamp, State=stmt.inserted.State)
 
-            result = self.connection.execute(stmt)
+    def _rollup_upsert(self, table : Table):
+        # Junta ao que já lá está. A média é calculada antes de a soma e a contagem mudarem
+        stmt = upsert(table)
+        merged = [("AvgTemperature", (table.c.TemperatureSum + stmt.inserted.TemperatureSum)
+                   / func.nullif(table.c.SampleCount + stmt.inserted.SampleCount, 0)),
+                  ("MinTemperature", func.least(func.coalesce(table.c.MinTemperature, stmt.inserted.MinTemperature),
+                                                func.coalesce(stmt.inserted.MinTemperature, table.c.MinTemperature))),
+                  ("MaxTemperature", func.greatest(func.coalesce(table.c.MaxTemperature, stmt.inserted.MaxTemperature),
+                                                   func.coalesce(stmt.inserted.MaxTemperature, table.c.MaxTemperature)))]
+        for column in ("SampleCount", "TemperatureSum", "BurningSeconds") + MODE_COLUMNS:
+            merged.append((column, table.c[column] + stmt.inserted[column]))
+        return stmt.on_duplicate_key_update(merged)
 
-            return result.fetchall()
+    def insert_rollup_progress(self, hourly_rows : list[dict], daily_rows : list[dict], last_timestamp : int, state : dict, boiler_id : int = 1) -> int:
+        # Agregados e checkpoint na mesma transação. Uma execução repetida não soma duas vezes
+        for row in hourly_rows + daily_rows:
+            row["BoilerID"] = boiler_id
+        checkpoint = self._checkpoint_upsert(form_checkpoint_name(boiler_id, "rollup"), last_timestamp, state)
+
+        def work(connection):
+            if len(hourly_rows) > 0:
+                connection.execute(self._rollup_upsert(self.rollup_hourly), hourly_rows)
+            if len(daily_rows) > 0:
+                connection.execute(self._rollup_upsert(self.rollup_daily), daily_rows)
+            connection.execute(checkpoint)
+
+        try:
+            self._execute(work)
+            self.log.info(f"Rolled up {len(hourly_rows)} hours and {len(daily_rows)} days. Checkpoint at {last_timestamp}")
+            return len(hourly_rows)
+        except SQLAlchemyError as e:
+            self.log.critical(f"Command Error: {e}. Rollup checkpoint not advanced")
+            return None
+
+    def insert_report_progress(self, report_objects : list[ReportData], last_timestamp : int, state : dict, boiler_id : int = 1) -> int:
+        # Reports e checkpoint na mesma transação para não haver reports duplicados
+        rows = [self._report_row(report, boiler_id) for report in report_objects]
+        stmt = self._checkpoint_upsert(form_checkpoint_name(boiler_id), last_timestamp, state)
+        def work(connection):
+            if len(rows) > 0:
+                connection.execute(self._insert_report, rows)
+            connection.execute(stmt)
+
+        try:
+            self._execute(work)
+            self.log.info(f"Inserted {len(rows)} report records. Checkpoint at {last_timestamp}")
+            return len(rows)
+        except SQLAlchemyError as e:
+            self.log.critical(f"Command Error: {e}. Checkpoint not advanced")
+            return None
+
+    def _hot_start(self, timestamp_int : int) -> int:
+        # Records antes do fim do arquivo já não estão na tabela. Se o DROP falhou não são lidos duas vezes
+        return timestamp_int if self.archive is None else max(timestamp_int, self.archive.end_timestamp)
+
+    def get_report_records_after(self, timestamp_int : int = None, chunk_size : int = 1000, boiler_id : int = 1):
+        # Cursor do lado do servidor numa ligação à parte. A ligação principal fica livre para escrever
+        timestamp = timestamp_int
+        try:
+            if timestamp_int is None:
+                timestamp = self.get_reporting_last_end_time(boiler_id)
+                timestamp_int = int(timestamp.timestamp())
+            if self.archive is not None:
+                yield from self.archive.iter_records(timestamp_int + 1, self.archive.end_timestamp, boiler_id)
+            stmt = select(self.records.c.SystemTimestamp,
+                          self.records.c.Temperature,
+                          self.records.c.MarkedTime,
+                          self.records.c.RunningMode,
+                          self.records.c.IsBurning
+                          ).where(self.records.c.SystemTimestamp > timestamp_int,
+                                  self.records.c.SystemTimestamp >= self._hot_start(timestamp_int),
+                                  self.records.c.BoilerID == boiler_id
+                                  ).order_by(self.records.c.SystemTimestamp.asc())
+
+            with self.engine.connect() as stream_connection:
+                result = stream_connection.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+                for row in result:
+                    yield row
         except TypeError as e:
             self.log.error(f"Type error on {timestamp}: {e}")
-            return []
         except SQLAlchemyError as e:
             self.log.error(f"Error fetching records after {timestamp}: {e}")
+
+    def was_burning_before(self, timestamp_int : int, boiler_id : int = 1) -> bool:
+        # A última leitura antes do instante estava a queimar. Na tabela ou, se lá não houver, no arquivo
+        stmt = select(self.records.c.IsBurning).where(self.records.c.SystemTimestamp < timestamp_int,
+                                                      self.records.c.SystemTimestamp >= self._hot_start(0),
+                                                      self.records.c.BoilerID == boiler_id
+                                                      ).order_by(self.records.c.SystemTimestamp.desc()).limit(1)
+        is_burning = self._execute(lambda connection: connection.execute(stmt).scalar())
+        if is_burning is not None or self.archive is None:
+            return bool(is_burning)
+
+        for month in reversed(self.archive.months()):
+            if int(month.timestamp()) >= timestamp_int:
+                continue
+            for block in self.archive.read_arrays(int(month.timestamp()), timestamp_int, boiler_id):
+                if len(block["is_burning"]) > 0:
+                    return bool(block["is_burning"][-1])
+        return False
+
+    def get_record_arrays(self, start_timestamp : int, end_timestamp : int, chunk_size : int = 100000, boiler_id : int = 1) -> dict:
+        # Colunas do período em arrays NumPy para o processamento em bloco. Só quem reconstrói paga o import
+        import numpy as np
+
+        timestamps, temperatures, mode_codes, is_burning = [], [], [], []
+        if self.archive is not None:
+            for block in self.archive.read_arrays(start_timestamp, end_timestamp, boiler_id):
+                timestamps.append(block["timestamps"])
+                temperatures.append(block["temperatures"])
+                mode_codes.append(block["mode_codes"])
+                is_burning.append(block["is_burning"])
+
+        stmt = select(self.records.c.SystemTimestamp,
+                      self.records.c.Temperature,
+                      self.records.c.RunningMode,
+                      self.records.c.IsBurning
+                      ).where(self.records.c.SystemTimestamp >= self._hot_start(start_timestamp),
+                              self.records.c.SystemTimestamp < end_timestamp,
+                              self.records.c.BoilerID == boiler_id
+                              ).order_by(self.records.c.SystemTimestamp.asc())
+
+        with self.engine.connect() as stream_connection:
+            result = stream_connection.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+            for chunk in result.partitions():
+                columns = list(zip(*chunk))
+                timestamps.append(np.array(columns[0], dtype=np.int64))
+                temperatures.append(np.array(columns[1], dtype=np.int16))
+                mode_codes.append(np.array([MODE_CODES.get(mode, -1) for mode in columns[2]], dtype=np.int64))
+                is_burning.append(np.array(columns[3], dtype=bool))
+
+        if len(timestamps) == 0:
+            return {"timestamps": np.empty(0, dtype=np.int64), "temperatures": np.empty(0, dtype=np.int16),
+                    "mode_codes": np.empty(0, dtype=np.int64), "is_burning": np.empty(0, dtype=bool)}
+
+        return {"timestamps": np.concatenate(timestamps),
+                "temperatures": np.concatenate(temperatures),
+                "mode_codes": np.concatenate(mode_codes),
+                "is_burning": np.concatenate(is_burning)}
+
+    def get_record_partitions(self) -> list[tuple[str, int]]:
+        # Nome e limite superior de cada partição da tabela records. O pmax não tem limite
+        if not self.supports_partitions:
             return []
-    def insert_report_record(self, report_object : ReportData):
-        stmt = insert(self.report).values(StartTime=report_object.start_time,
-                                        EndTime=report_object.end_time,
-                                        AvgTemperature=report_object.avg_temperature,
-                                        Mode1=report_object.operation_time["mode1"],
-                                        Mode2=report_object.operation_time["mode2"],
-                                        Mode3=report_object.operation_time["mode3"],
-                                        Mode4=report_object.operation_time["mode4"],
-                                        Mode5=report_object.operation_time["mode5"],
-                                        ModeA=report_object.operation_time["modeA"],
-                                        TotalDuration=report_object.total_duration,
-                                        HasStandby=report_object.has_standby
-                                        )
-        stmt.compile(self.engine, compile_kwargs={"literal_binds": True})
+        stmt = text("SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'records' AND PARTITION_NAME IS NOT NULL "
+                    "ORDER BY PARTITION_ORDINAL_POSITION")
+        rows = self._execute(lambda connection: connection.execute(stmt).all())
+        return [(name, None if description == "MAXVALUE" else int(description)) for name, description in rows]
+
+    def partition_records(self, through : datetime) -> int:
+        """
+        Parte a tabela records por mês do SystemTimestamp, que já faz parte da chave primária.
+        Na primeira vez reorganiza a tabela toda. Depois só acrescenta os meses que faltam até through.
+        Devolve quantas partições mensais foram criadas.
+        """
+        if not self.supports_partitions:
+            return 0
+
+        partitions = self.get_record_partitions()
+        bounds = [bound for _, bound in partitions if bound is not None]
+        if len(bounds) > 0:
+            first_month = datetime.fromtimestamp(bounds[-1])
+        else:
+            first_timestamp = self._execute(lambda connection: connection.execute(
+                select(func.min(self.records.c.SystemTimestamp))).scalar())
+            first_month = month_start(datetime.now() if first_timestamp is None else datetime.fromtimestamp(first_timestamp))
+
+        months = []
+        month = first_month
+        while month <= month_start(through):
+            months.append(month)
+            month = add_months(month, 1)
+        if len(months) == 0:
+            return 0
+
+        clauses = ", ".join([form_partition_clause(month) for month in months] + ["PARTITION pmax VALUES LESS THAN MAXVALUE"])
+        if len(partitions) == 0:
+            statement = f"ALTER TABLE records PARTITION BY RANGE (SystemTimestamp) ({clauses})"
+        else:
+            statement = f"ALTER TABLE records REORGANIZE PARTITION pmax INTO ({clauses})"
+        self._execute(lambda connection: connection.execute(text(statement)))
+        self.log.info(f"Partitioned records from {months[0]:%Y-%m} to {months[-1]:%Y-%m}")
+        return len(months)
+
+    def get_archivable_months(self, before : datetime) -> list[datetime]:
+        # Meses com records que acabam antes de before. Com partições são os das partições, sem elas vêm do primeiro record
+        partitions = self.get_record_partitions()
+        if len(partitions) > 0:
+            return [add_months(datetime.fromtimestamp(bound), -1) for _, bound in partitions
+                    if bound is not None and bound <= before.timestamp()]
+
+        first_timestamp = self._execute(lambda connection: connection.execute(
+            select(func.min(self.records.c.SystemTimestamp))).scalar())
+        if first_timestamp is None:
+            return []
+        months = []
+        month = month_start(datetime.fromtimestamp(first_timestamp))
+        while add_months(month, 1) <= before:
+            months.append(month)
+            month = add_months(month, 1)
+        return months
+
+    def get_month_columns(self, month : datetime, chunk_size : int = 100000) -> dict:
+        # Todas as colunas e caldeiras de um mês, para o arquivo
+        stmt = select(self.records.c.SystemTimestamp,
+                      self.records.c.Temperature,
+                      self.records.c.MarkedTime,
+                      self.records.c.RunningMode,
+                      self.records.c.IsBurning,
+                      self.records.c.BoilerID
+                      ).where(self.records.c.SystemTimestamp >= int(month.timestamp()),
+                              self.records.c.SystemTimestamp < int(add_months(month, 1).timestamp())
+                              ).order_by(self.records.c.SystemTimestamp.asc())
+
+        names = ("timestamps", "temperatures", "marked_times", "running_modes", "is_burning", "boiler_ids")
+        columns = {name: [] for name in names}
+        with self.engine.connect() as stream_connection:
+            result = stream_connection.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+            for chunk in result.partitions():
+                for name, values in zip(names, zip(*chunk)):
+                    columns[name].extend(values)
+        return columns
+
+    def drop_month(self, month : datetime, archived_count : int) -> bool:
+        # Só apaga se o mês ainda tiver exatamente os records que foram arquivados
+        start_timestamp = int(month.timestamp())
+        end_timestamp = int(add_months(month, 1).timestamp())
+        partition_name = form_partition_name(month)
+        is_partition = partition_name in [name for name, _ in self.get_record_partitions()]
+
+        def work(connection):
+            if is_partition:
+                count = connection.execute(text(f"SELECT COUNT(*) FROM records PARTITION ({partition_name})")).scalar()
+            else:
+                count = connection.execute(select(func.count()).select_from(self.records).where(
+                    self.records.c.SystemTimestamp >= start_timestamp,
+                    self.records.c.SystemTimestamp < end_timestamp)).scalar()
+            if count != archived_count:
+                return count
+            if is_partition:
+                # Largar a partição é instantâneo e não deixa a tabela fragmentada como um DELETE
+                connection.execute(text(f"ALTER TABLE records DROP PARTITION {partition_name}"))
+            else:
+                connection.execute(delete(self.records).where(self.records.c.SystemTimestamp >= start_timestamp,
+                                                              self.records.c.SystemTimestamp < end_timestamp))
+            return count
+
         try:
-            
-            result = self.connection.execute(stmt)
-            self.connection.commit()
-            self.log.info(f"Inserted report record with ID {result.inserted_primary_key[0]}")
-                
-            return result.inserted_primary_key[0]
-        except IntegrityError as e:
-            self.log.error(f"Integrity Error: {e.orig}")  # NULL
-            return None
+            count = self._execute(work)
         except SQLAlchemyError as e:
-            self.log.critical(f"Command Error: {e}") 
-            return None
-        except Exception as e:
-            self.log.critical(f"Unexpected Error: {e}")
-            return None
+            self.log.error(f"Couldn't drop records of {month:%Y-%m}: {e}")
+            return False
+        if count != archived_count:
+            self.log.error(f"Records of {month:%Y-%m} changed while archiving ({archived_count} archived, {count} in table). Kept in the table")
+            return False
+        self.log.info(f"Dropped {count} records of {month:%Y-%m} from the table")
+        return True
 
-    def insert_record(self, record_object):
-        pk = int(datetime.now().timestamp())
-        stmt = insert(self.records).values(SystemTimestamp=pk,
-                                        Temperature=record_object.temperature,
-                                        MarkedTime=record_object.marked_time.strftime("%Y-%m-%dT%H:%MZ"),
-                                        RunningMode=record_object.running_mode,
-                                        IsBurning=record_object.is_burning)
-        stmt.compile(self.engine, compile_kwargs={"literal_binds": True})
+    def replace_reports(self, report_objects : list[ReportData], start_time : datetime, end_time : datetime, boiler_id : int = 1) -> int:
+        # Reports que começam à mesma hora são actualizados para não perder a ligação ao consumo.
+        # Os novos são inseridos e os que já não existem são apagados. Tudo numa transação
+        # Um ciclo ainda aberto no fim do período não é recalculado, por isso o report dele fica como está
+        stmt = select(self.report.c.StartTime, self.report.c.ID).where(self.report.c.StartTime >= start_time,
+                                                                       self.report.c.EndTime < end_time,
+                                                                       self.report.c.BoilerID == boiler_id)
+
+        def work(connection):
+            existing = {row[0]: row[1] for row in connection.execute(stmt)}
+
+            updates, inserts = [], []
+            for report_object in report_objects:
+                row = self._report_row(report_object, boiler_id)
+                if report_object.start_time in existing:
+                    row["report_id"] = existing.pop(report_object.start_time)
+                    updates.append(row)
+                else:
+                    inserts.append(row)
+
+            if len(updates) > 0:
+                connection.execute(update(self.report).where(self.report.c.ID == bindparam("report_id")), updates)
+            if len(inserts) > 0:
+                connection.execute(self._insert_report, inserts)
+            if len(existing) > 0:
+                connection.execute(delete(self.report).where(self.report.c.ID.in_(list(existing.values()))))
+            return len(updates), len(inserts), len(existing)
 
+        # Uma repetição depois de a ligação cair volta a ler o que existe. A transação anterior não ficou
         try:
-            
-            result = self.connection.execute(stmt)
-            self.connection.commit()
-                
-            if result.inserted_primary_key[0] is None:
-                return pk
-                
-            return result.inserted_primary_key[0]
-        except IntegrityError as e:
-            self.log.error(f"Integrity Error: {e.orig}")  #NULL
-            return None
+            updated, inserted, deleted = self._execute(work)
+            self.log.info(f"Reports rebuilt: {updated} updated, {inserted} inserted, {deleted} deleted")
+            return len(report_objects)
         except SQLAlchemyError as e:
-            self.log.critical(f"Command Error: {e}")  
-            return None
-        except Exception as e:
-            self.log.critical(f"Unexpected Error: {e}")
+            self.log.critical(f"Command Error: {e}. Reports not rebuilt")
             return None
+
+    def _insert_many(self, stmt, rows : list[dict]) -> int:
+        if len(rows) == 0:
+            return 0
+        try:
+            self._execute(lambda connection: connection.execute(stmt, rows))
+            return len(rows)
+        except IntegrityError as e:
+            DB_ERRORS.inc()
+            self.log.warning(f"Integrity Error on batch of {len(rows)} rows for {stmt.table.name}: {e.orig}. Retrying one by one")
+        except SQLAlchemyError:
+            # Outros erros sobem para quem chamou decidir se perde ou repete as linhas
+            DB_ERRORS.inc()
+            raise
+
+        # Um duplicado não pode deitar fora o lote inteiro
+        inserted = 0
+        for row in rows:
+            try:
+                self._execute(lambda connection: connection.execute(stmt, row))
+                inserted += 1
+            except IntegrityError as e:
+                DB_ERRORS.inc()
+                self.log.error(f"Integrity Error: {e.orig}")
+            except SQLAlchemyError:
+                DB_ERRORS.inc()
+                raise
+        return inserted
+
+    def _report_row(self, report_object : ReportData, boiler_id : int = 1) -> dict:
+        operation_time = report_object.operation_time
+        return {"StartTime": report_object.start_time,
+                "EndTime": report_object.end_time,
+                "AvgTemperature": report_object.avg_temperature,
+                "Mode1": operation_time["mode1"],
+                "Mode2": operation_time["mode2"],
+                "Mode3": operation_time["mode3"],
+                "Mode4": operation_time["mode4"],
+                "Mode5": operation_time["mode5"],
+                "ModeA": operation_time["modeA"],
+                "TotalDuration": report_object.total_duration,
+                "HasStandby": report_object.has_standby,
+                "BoilerID": boiler_id
+                }
+
+    def insert_records(self, rows : list[dict]) -> int:
+        # Linhas já no formato da tabela records. Erros de ligação sobem para o spool tentar de novo
+        return self._insert_many(self._insert_records, rows)
+
+    def insert_record(self, record_object):
+        row = form_record_row(record_object)
+        pk = row["SystemTimestamp"]
+
+        with self._lock:
+            self._pending_records.append(row)
+            if len(self._pending_records) >= self.batch_size or self._is_flush_due():
+                if self.flush() == 0:
+                    return None
+        return pk
+
+    def _is_flush_due(self) -> bool:
+        return self.flush_interval > 0 and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self) -> int:
+        with self._lock:
+            rows = self._pending_records
+            self._pending_records = []
+            self._last_flush = time.monotonic()
+            if len(rows) == 0:
+                return 0
+
+            try:
+                inserted = self._insert_many(self._insert_records, rows)
+            except SQLAlchemyError as e:
+                self.log.critical(f"Command Error: {e}. Lost {len(rows)} records")
+                return 0
+        self.log.debug(f"Flushed {inserted} of {len(rows)} records")
+        return inserted
+
+    def flush_if_due(self) -> int:
+        with self._lock:
+            if len(self._pending_records) > 0 and self._is_flush_due():
+                return self.flush()
+        return 0
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.flush()
+            stats = self.pool_stats()
+            self.engine.dispose()
+        self.log.info(f"DB Connection closed. Pool: {stats['status']}, retried {stats['retried']} operations")
+
     def __del__(self):
-        self.connection.close()
-        self.log.info("DB Connection closed")
\ No newline at end of file
+        if hasattr(self, "engine"):
+            self.close()
\ No newline at end of file
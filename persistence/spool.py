@@ -0,0 +1,138 @@
+import logging
+import sqlite3
+import threading
+from typing import Callable
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from persistence.database import MariaDBHandler, form_record_row
+
+SPOOL_COLUMNS = ("SystemTimestamp", "Temperature", "MarkedTime", "RunningMode", "IsBurning", "BoilerID")
+
+class RecordSpool:
+    """
+    Fila local em SQLite (WAL) onde o ciclo de captura escreve os registos.
+    Uma thread liga-se à MariaDB, envia-os por lotes e avança o checkpoint.
+    Se a base de dados estiver em baixo, mesmo no arranque, os registos esperam no disco.
+    """
+    def __init__(self, file_name : str, logger : logging.Logger, batch_size : int = 500, interval : float = 1, max_retry_delay : float = 300):
+        self.log = logger
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_retry_delay = max_retry_delay
+        self.shipped = 0
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._db_handler = None
+        self._form_db_handler = None
+
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS spool (
+                                    ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    SystemTimestamp INTEGER NOT NULL,
+                                    Temperature INTEGER NOT NULL,
+                                    MarkedTime TEXT,
+                                    RunningMode TEXT,
+                                    IsBurning INTEGER NOT NULL,
+                                    BoilerID INTEGER NOT NULL DEFAULT 1)""")
+        # Spools criados antes das várias caldeiras
+        if "BoilerID" not in [column[1] for column in self._connection.execute("PRAGMA table_info(spool)")]:
+            self._connection.execute("ALTER TABLE spool ADD COLUMN BoilerID INTEGER NOT NULL DEFAULT 1")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS checkpoint (Name TEXT PRIMARY KEY, LastID INTEGER NOT NULL)")
+        self._connection.commit()
+        self.log.info(f"Spool {file_name} opened with {self.pending} records waiting")
+
+    @property
+    def checkpoint(self) -> int:
+        with self._lock:
+            row = self._connection.execute("SELECT LastID FROM checkpoint WHERE Name = 'records'").fetchone()
+        return 0 if row is None else row[0]
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def insert_record(self, record_object):
+        # Mesma interface do MariaDBHandler para o BoilerData não notar a diferença
+        row = form_record_row(record_object)
+        with self._lock:
+            self._connection.execute(f"INSERT INTO spool ({', '.join(SPOOL_COLUMNS)}) VALUES ({', '.join('?' * len(SPOOL_COLUMNS))})",
+                                     tuple(row[column] for column in SPOOL_COLUMNS))
+            self._connection.commit()
+        return row["SystemTimestamp"]
+
+    def _read_batch(self) -> tuple[int, list[dict]]:
+        with self._lock:
+            rows = self._connection.execute(f"SELECT ID, {', '.join(SPOOL_COLUMNS)} FROM spool ORDER BY ID LIMIT ?",
+                                            (self.batch_size,)).fetchall()
+        if len(rows) == 0:
+            return 0, []
+        records = [dict(zip(SPOOL_COLUMNS, row[1:])) for row in rows]
+        for record in records:
+            record["IsBurning"] = bool(record["IsBurning"])
+        return rows[-1][0], records
+
+    def _advance(self, last_id : int):
+        # Checkpoint e limpeza na mesma transação. Depois de um restart continua daqui
+        with self._lock:
+            self._connection.execute("INSERT INTO checkpoint (Name, LastID) VALUES ('records', ?) "
+                                     "ON CONFLICT(Name) DO UPDATE SET LastID = excluded.LastID", (last_id,))
+            self._connection.execute("DELETE FROM spool WHERE ID <= ?", (last_id,))
+            self._connection.commit()
+
+    def drain(self) -> int:
+        shipped = 0
+        while True:
+            last_id, records = self._read_batch()
+            if len(records) == 0:
+                return shipped
+            self._db_handler.insert_records(records)
+            self._advance(last_id)
+            shipped += len(records)
+            self.shipped += len(records)
+
+    def _connect(self):
+        # O handler liga-se no construtor. Só é criado aqui para a captura não esperar pela base de dados
+        if self._db_handler is None:
+            self._db_handler = self._form_db_handler()
+
+    def _run(self):
+        delay = self.interval
+        while not self._stop_event.is_set():
+            try:
+                self._connect()
+                shipped = self.drain()
+                if shipped > 0:
+                    self.log.debug(f"Shipped {shipped} records from spool")
+                delay = self.interval
+            except SQLAlchemyError as e:
+                self.log.error(f"Couldn't ship spooled records. Retrying in {delay}s: {e}")
+                delay = min(max(delay, 1) * 2, self.max_retry_delay)
+            self._stop_event.wait(delay)
+
+    def start(self, form_db_handler : Callable[[], MariaDBHandler]):
+        self._form_db_handler = form_db_handler
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="spool-drainer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        # Última tentativa. O que não for enviado fica para o próximo arranque
+        if self._db_handler is not None:
+            try:
+                self.drain()
+            except SQLAlchemyError as e:
+                self.log.warning(f"Spool not fully drained: {e}")
+            self._db_handler.close()
+        self.log.info(f"Spool closed with {self.pending} records waiting")
+        self._connection.close()